@@ -0,0 +1,89 @@
+"""
+Writes the mp4 of a run. Frames are piped to ffmpeg as raw RGBA, in time order,
+whether they were just drawn, rendered by a worker process (see parallel_frames)
+or finished by an earlier run and kept as PNGs (see run_manifest).
+"""
+import subprocess
+import numpy as np
+from PIL import Image
+
+import instrumentation
+
+def save_frame(file_name, rgba, size):
+    """Keeps a frame's pixels as a PNG, which is lossless, so it can go into the video of a later run."""
+    with instrumentation.timer("frame caching"):
+        Image.frombuffer("RGBA", size, rgba, "raw", "RGBA", 0, 1).save(file_name, compress_level=1)
+
+def load_frame(file_name):
+    """The RGBA bytes and (width, height) of a frame kept by save_frame."""
+    with instrumentation.timer("frame caching"):
+        with Image.open(file_name) as image:
+            return np.asarray(image.convert("RGBA")).tobytes(), image.size
+
+class FrameAssembler:
+    """
+    Pipes frames to ffmpeg in time order. Frames that arrive ahead of their turn
+    are held in a reorder buffer until every frame before them has been written.
+    ffmpeg is started with the first frame, which sets the video's size.
+    """
+
+    def __init__(self, anim_name, frame_rate, ffmpeg_path, bitrate=5000):
+        self.anim_name = anim_name
+        self.frame_rate = frame_rate
+        self.ffmpeg_path = ffmpeg_path
+        self.bitrate = bitrate
+        self.buffer = {}        # k: frame number; v: RGBA bytes and size, or the file a cached frame is in
+        self.next_frame = 0
+        self.size = None
+        self.proc = None
+
+    def start(self, size):
+        print(f"FFmpeg using path: {self.ffmpeg_path}")
+        self.size = size
+        command = [ self.ffmpeg_path,
+                    "-f", "rawvideo", "-vcodec", "rawvideo", "-s", "%dx%d" % size, "-pix_fmt", "rgba",
+                    "-framerate", str(self.frame_rate), "-loglevel", "error", "-i", "pipe:",
+                    "-vcodec", "h264", "-pix_fmt", "yuv420p", "-b", f"{self.bitrate}k",
+                    # h264 needs an even width and height
+                    "-vf", "pad=width=ceil(iw/2)*2:height=ceil(ih/2)*2",
+                    "-y", self.anim_name ]
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def add_frame(self, frame, rgba, size):
+        if frame != self.next_frame:
+            instrumentation.count("frames held for reordering")
+        self.buffer[frame] = (rgba, size)
+        self.write_ready()
+
+    def add_cached_frame(self, frame, file_name):
+        """Adds a frame saved by save_frame, which is only read once it is the frame's turn."""
+        self.buffer[frame] = file_name
+        self.write_ready()
+
+    def write_ready(self):
+        while self.next_frame in self.buffer:
+            entry = self.buffer.pop(self.next_frame)
+            rgba, size = load_frame(entry) if isinstance(entry, str) else entry
+            if self.proc is None:
+                self.start(size)
+            if size != self.size or len(rgba) != size[0] * size[1] * 4:
+                raise ValueError(f"Frame {self.next_frame} is {size[0]}x{size[1]}, "
+                                 f"the animation is {self.size[0]}x{self.size[1]}")
+            with instrumentation.timer("animation frames"):
+                self.proc.stdin.write(rgba)
+            self.next_frame += 1
+
+    def finish(self):
+        """Closes the pipe so ffmpeg writes out the video. Returns False if no frames were written."""
+        proc = self.proc
+        self.proc = None
+        if self.buffer:
+            print(f"{len(self.buffer)} frames after frame {self.next_frame} left out of the animation")
+        self.buffer.clear()
+        if proc is None:
+            return False
+        with instrumentation.timer("ffmpeg encoding"):
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with code {proc.returncode} writing {self.anim_name}")
+        return True
@@ -0,0 +1,292 @@
+"""
+Times each stage of the PaleoMapper pipeline on synthetic inputs and writes the
+results as JSON, so optimizations can be compared run to run.
+
+python benchmark.py                                   # default sizes, results in benchmarks/
+python benchmark.py --plates 400 --depth 6 --features 2000 --vertices 200
+python benchmark.py --stages rotfnd process_chunks --compare benchmarks/baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# must be set before pyplot is imported anywhere
+import matplotlib
+matplotlib.use("Agg")
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+import file_handling
+import rotation_engine_vector
+import synthetic_data
+from create_dat import saveDAT
+from rotation_engine_class import RotationEngine
+from rotation_engine_vector import VectorRotationEngine, adder_batch
+
+ENGINES = { "class": RotationEngine, "vector": VectorRotationEngine }
+
+class Benchmark:
+    """
+    Builds the synthetic inputs in a scratch directory and times each pipeline
+    stage. Stages that consume chunks get freshly read chunks on every repeat,
+    since process_chunks rewrites their records in place.
+    """
+
+    def __init__(self, args, work_dir):
+        self.args = args
+        self.work_dir = work_dir
+        self.plot_time = args.time
+        self.rot_file = os.path.join(work_dir, "synthetic.rot")
+        self.dat_file = os.path.join(work_dir, "synthetic.dat")
+        self.csv_file = os.path.join(work_dir, "synthetic.csv")
+
+        plates = synthetic_data.write_rotation_model(self.rot_file, args.plates, args.depth,
+                                                     args.time_samples, args.max_time, args.seed)
+        synthetic_data.write_dat_geometry(self.dat_file, args.features, args.vertices, plates,
+                                          args.max_time, args.seed)
+        synthetic_data.write_csv_symbols(self.csv_file, args.symbols, plates, args.seed)
+        # read_csv_in_chunks loads the symbol library from the working directory
+        shutil.copy(os.path.join(REPO_DIR, "shape_library.csv"), work_dir)
+
+        self.dat_files = [[True, False, self.dat_file, "", ""]]
+        self.csv_files = [[True, False, self.csv_file, "infile", "infile"]]
+        self.engine_class = ENGINES[args.engine]
+        self.engine = self.engine_class()
+        self.engine.rotfnd(self.rot_file, self.plot_time)
+        self.figure = None
+
+        self.stages = {
+            "rotfnd": self.bench_rotfnd,
+            "adder": self.bench_adder,
+            "adder_batch": self.bench_adder_batch,
+            "sanitize_dat": self.bench_sanitize_dat,
+            "read_files": self.bench_read_files,
+            "read_files_csv": self.bench_read_files_csv,
+            "process_chunks": self.bench_process_chunks,
+            "process_polygons": self.bench_process_polygons,
+            "plot_to_screen": self.bench_plot_to_screen,
+            "save_dat": self.bench_save_dat,
+            "save_kml": self.bench_save_kml,
+        }
+
+    def read_chunks(self):
+        dat = file_handling.sanitize_dat(self.dat_file, self.plot_time)
+        return list(file_handling.read_file_in_chunks(dat, "", ""))
+
+    def rotated_chunks(self):
+        return list(self.engine.process_chunks(self.read_chunks()))
+
+    def count_vertices(self, chunks):
+        return sum(len(chunk.records) for chunk in chunks)
+
+    # Each bench_ method does its setup, then returns (timed function, items, unit)
+
+    def bench_rotfnd(self):
+        def run():
+            # the vector engine keeps parsed models, which would leave only the class engine parsing the file
+            rotation_engine_vector._model_cache.clear()
+            self.engine_class().rotfnd(self.rot_file, self.plot_time)
+        return run, self.args.plates, "plates"
+
+    def adder_poles(self):
+        return [ (lat % 180 - 90.0, lon % 360 - 180.0, angle % 90 + 1.0)
+                 for lat, lon, angle in zip(range(0, 7000, 7), range(0, 13000, 13), range(0, 3000, 3)) ]
+
+    # adder and adder_batch combine the same pole pairs whatever the engine, so they compare run to run
+    def bench_adder(self):
+        poles = self.adder_poles()
+        def run():
+            for i in range(len(poles) - 1):
+                self.engine.adder(*poles[i], *poles[i + 1])
+        return run, len(poles) - 1, "calls"
+
+    def bench_adder_batch(self):
+        poles = self.adder_poles()
+        poles1 = list(zip(*poles[:-1]))
+        poles2 = list(zip(*poles[1:]))
+        def run():
+            adder_batch(*poles1, *poles2)
+        return run, len(poles) - 1, "calls"
+
+    def bench_sanitize_dat(self):
+        def run():
+            file_handling.sanitize_dat(self.dat_file, self.plot_time)
+        return run, self.args.features, "features"
+
+    def bench_read_files(self):
+        def run():
+            for chunk in file_handling.read_files(self.dat_files, self.plot_time):
+                pass
+        return run, self.args.features, "features"
+
+    def bench_read_files_csv(self):
+        def run():
+            for chunk in file_handling.read_files(self.csv_files, self.plot_time):
+                pass
+        return run, self.args.symbols, "symbols"
+
+    def bench_process_chunks(self):
+        chunks = self.read_chunks()
+        records = [ chunk.records for chunk in chunks ]
+        def run():
+            for chunk, chunk_records in zip(chunks, records):
+                chunk.records = chunk_records
+            for chunk in self.engine.process_chunks(chunks):
+                pass
+        return run, self.count_vertices(chunks), "vertices"
+
+    def bench_process_polygons(self):
+        figure = self.get_figure()
+        chunks = self.rotated_chunks()
+        def run():
+            for chunk in chunks:
+                figure.process_polygons(chunk.records)
+        return run, self.count_vertices(chunks), "vertices"
+
+    def bench_plot_to_screen(self):
+        figure = self.get_figure()
+        chunks = self.rotated_chunks()
+        def run():
+            for chunk in figure.plot_to_screen(chunks):
+                pass
+            figure.fig.canvas.draw()
+        return run, self.count_vertices(chunks), "vertices"
+
+    def bench_save_dat(self):
+        chunks = self.rotated_chunks()
+        out_file = os.path.join(self.work_dir, "output.dat")
+        def run():
+            for chunk in saveDAT(out_file).save_to_dat(chunks, self.plot_time):
+                pass
+        return run, self.count_vertices(chunks), "vertices"
+
+    def bench_save_kml(self):
+        from create_kml import saveKML
+        chunks = self.rotated_chunks()
+        out_file = os.path.join(self.work_dir, "output.kml")
+        def run():
+            for chunk in saveKML(out_file).save_to_kml(chunks):
+                pass
+        return run, self.count_vertices(chunks), "vertices"
+
+    def get_figure(self):
+        if self.figure is None:
+            from draw_map_gui import Figure
+            self.figure = Figure(0, lat_spacing=30, lon_spacing=60, map_bounds=[-180, 180, -90, 90])
+            self.figure.update_plot_vars({"plot": False, "save": False, "anim": False}, self.plot_time)
+        return self.figure
+
+    def time_stage(self, name):
+        run, items, unit = self.stages[name]()
+        timings = []
+        for _ in range(self.args.repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        median = statistics.median(timings)
+        return { "median": median,
+                 "min": min(timings),
+                 "mean": statistics.mean(timings),
+                 "timings": timings,
+                 "items": items,
+                 "unit": unit,
+                 "per_second": items / median if median else None }
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO_DIR)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline_file, tolerance):
+    """Prints the change against a previous results file and returns the stages that got slower."""
+    with open(baseline_file, "r") as f:
+        baseline = json.load(f)["stages"]
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["median"] / baseline[name]["median"] - 1.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:18s} {baseline[name]['median']:9.4f}s -> {result['median']:9.4f}s  {change:+7.1%}{flag}")
+    return regressions
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark PaleoMapper pipeline stages on synthetic data.")
+    parser.add_argument("--plates", type=int, default=100, help="plates in the rotation model")
+    parser.add_argument("--depth", type=int, default=4, help="depth of the plate reference tree")
+    parser.add_argument("--time-samples", type=int, default=20, help="stage poles per plate")
+    parser.add_argument("--max-time", type=float, default=600.0)
+    parser.add_argument("--features", type=int, default=500, help="DAT polygon features")
+    parser.add_argument("--vertices", type=int, default=50, help="vertices per DAT feature")
+    parser.add_argument("--symbols", type=int, default=200, help="CSV symbols")
+    parser.add_argument("--time", type=float, default=100.0, help="reconstruction time (Ma)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=list(ENGINES), default="class",
+                        help="rotation engine for rotfnd and process_chunks, the pipeline uses class")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", help="only run these stages")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/<timestamp>.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="slowdown (fraction of the baseline median) counted as a regression")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir)     # rotfnd and sanitize_dat write scratch files to the working directory
+        try:
+            bench = Benchmark(args, work_dir)
+            stages = args.stages or list(bench.stages)
+            for name in stages:
+                if name not in bench.stages:
+                    print(f"Unknown stage {name}, choose from {', '.join(bench.stages)}", file=sys.stderr)
+                    return 2
+                results[name] = bench.time_stage(name)
+                result = results[name]
+                print(f"{name:18s} {result['median']:9.4f}s  ({result['per_second']:,.0f} {result['unit']}/s)")
+        finally:
+            os.chdir(cwd)
+
+    report = { "created": datetime.datetime.now().isoformat(timespec="seconds"),
+               "commit": git_commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "parameters": { k: v for k, v in vars(args).items() if k not in ("output", "compare", "tolerance") },
+               "stages": results }
+
+    output = args.output
+    if not output:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(REPO_DIR, "benchmarks", f"{stamp}.json")
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        if compare(results, args.compare, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Headless PaleoMapper: runs the same pipeline as the GUI from a project .json,
+without a display or any Qt import.
+
+python cli.py input/proj.json --rot default_input/Scotese_Plate_Model.rot \
+    --start 0 --end 200 --step 10 --projection Mollweide --outputs pdf mp4
+
+Several projections can be drawn from the same run, each to its own files:
+
+python cli.py input/proj.json --rot default_input/Scotese_Plate_Model.rot \
+    --start 100 --projection Mollweide Orthographic Stereographic --center 30 100
+"""
+import argparse
+import os
+import sys
+
+# must be set before pyplot is imported anywhere
+import matplotlib
+matplotlib.use("Agg")
+
+import file_handling
+from pipeline import PlateTrackerJob, UserInterrupt, OutputFailed, PROJECTIONS, OUTPUTS, get_time_array
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Render PaleoMapper outputs without the GUI.")
+    parser.add_argument("project", help="project .json listing the geographic files and their colors")
+    parser.add_argument("--rot", required=True, help="rotation (.rot) file")
+    parser.add_argument("--all-files", action="store_true",
+                        help="use every file in the project, not only the checked ones")
+    parser.add_argument("--fixed-plate", default="", help="plate ID to hold fixed")
+
+    parser.add_argument("--start", type=float, required=True, help="reconstruction time (Ma)")
+    parser.add_argument("--end", type=float, help="end animation time (Ma)")
+    parser.add_argument("--step", type=float, default=10.0, help="time interval (Ma)")
+
+    parser.add_argument("--outputs", nargs="+", default=["pdf"],
+                        choices=[output for output in OUTPUTS if output != "plot"])
+    parser.add_argument("--output-dir", default="output")
+    parser.add_argument("--pdf-name", default="output.pdf")
+    parser.add_argument("--mp4-name", default="output.mp4")
+    parser.add_argument("--dat-name", default="output.dat")
+    parser.add_argument("--kml-name", default="output.kml")
+    parser.add_argument("--single-pdf", action="store_true",
+                        help="save every time as a page of one PDF instead of a PDF per time")
+    parser.add_argument("--images", nargs="+", default=[], metavar="FORMAT[:DPI]",
+                        help="more files saved with each PDF, e.g. png:50 png:300 svg (raster formats default to 100 dpi)")
+    parser.add_argument("--fps", type=int, default=6)
+    parser.add_argument("--report", default="run_report.json",
+                        help="timing and counter report written to the output directory ('' for none)")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile and tracemalloc every frame, saved to <output-dir>/profile/")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes rendering mp4 frames in parallel, assembled in time order")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the frames an earlier run of the same job finished")
+    parser.add_argument("--keep-frames", action="store_true",
+                        help="keep mp4 frames in <output-dir>/frames/ until the mp4 is written, so --resume can reuse them")
+
+    parser.add_argument("--kml-tolerance", type=float, default=0.0,
+                        help="degrees KML lines may be simplified by (default 0, every point)")
+    parser.add_argument("--no-simplify", action="store_true",
+                        help="draw every point, even those closer together than a pixel")
+
+    parser.add_argument("--projection", nargs="+", default=["Rectilinear"], choices=PROJECTIONS,
+                        help="one or more projections, drawn from the same rotated features")
+    parser.add_argument("--lat-spacing", type=int, default=30)
+    parser.add_argument("--lon-spacing", type=int, default=60)
+    parser.add_argument("--no-graticule", action="store_true")
+    parser.add_argument("--bounds", nargs=4, type=int, default=[-180, 180, -90, 90],
+                        metavar=("WEST", "EAST", "SOUTH", "NORTH"),
+                        help="map bounds for Rectilinear, Robinson, Mollweide, Mercator and Miller")
+    parser.add_argument("--center", nargs=2, type=float, default=[0.0, 0.0], metavar=("LAT", "LON"),
+                        help="center point for Orthographic, Azimuthal Equidistant and Transverse Mercator")
+    parser.add_argument("--hemisphere", choices=["north", "south"], default="north",
+                        help="hemisphere for Stereographic")
+    parser.add_argument("--min-lat", type=int, default=60, help="minimum latitude for Stereographic")
+    return parser
+
+def parse_args(argv):
+    return make_parser().parse_args(argv)
+
+def image_exports(images):
+    """--images as the (format, dpi) pairs Figure takes as exports."""
+    if not images:
+        return []
+    from draw_map_gui import VECTOR_FORMATS, RASTER_FORMATS     # loads cartopy and pyplot
+    exports = []
+    for image in images:
+        image_format, _, dpi = image.lower().partition(":")
+        if image_format == "pdf":
+            raise ValueError("PDF is saved with --outputs pdf, it can't also be one of the --images")
+        if image_format not in VECTOR_FORMATS + RASTER_FORMATS:
+            raise ValueError(f"Unknown image format {image_format}, choose from {', '.join(VECTOR_FORMATS + RASTER_FORMATS)}")
+        try:
+            exports.append((image_format, int(dpi) if dpi else None))
+        except ValueError:
+            raise ValueError(f"Unreadable image size {image}, expected FORMAT or FORMAT:DPI")
+    return exports
+
+def figure_kwargs(args, projection):
+    """Collects the same projection inputs that PlateTrackerApp.set_up_map reads from the window."""
+    proj_kwargs = {"simplify": not args.no_simplify, "exports": image_exports(args.images)}
+    if args.no_graticule:
+        proj_kwargs["lat_spacing"] = 180
+        proj_kwargs["lon_spacing"] = 720
+    else:
+        proj_kwargs["lat_spacing"] = args.lat_spacing
+        proj_kwargs["lon_spacing"] = args.lon_spacing
+
+    projection_option = PROJECTIONS.index(projection)
+    if projection_option in [3, 2, 6, 4, 0]:  # Mollweide Robinson Miller Mercator Rectilinear
+        west_bound, east_bound, south_bound, north_bound = args.bounds
+        if (north_bound < south_bound or east_bound < west_bound):
+            raise ValueError("Unresolvable bounds provided.")
+        proj_kwargs["map_bounds"] = [west_bound, east_bound, south_bound, north_bound]
+    elif projection_option in [1, 7, 5]:  # Orthographic AziEqui TransMerc
+        proj_kwargs["center_lat"], proj_kwargs["center_lon"] = args.center
+    elif projection_option == 8:  # Stereographic Plot
+        proj_kwargs["north_hemi"] = args.hemisphere == "north"
+        proj_kwargs["min_lat"] = args.min_lat
+
+    return projection_option, proj_kwargs
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    try:
+        image_exports(args.images)
+    except ValueError as err:
+        parser.error(f"--images: {err}")
+
+    try:
+        geo_files = file_handling.read_project_file(args.project)
+    except (OSError, ValueError) as err:
+        print(f"Could not read project file: {err}", file=sys.stderr)
+        return 1
+    if not args.all_files:
+        geo_files = [ file for file in geo_files if file[0] ]
+    if not geo_files:
+        print("No geographic files to plot", file=sys.stderr)
+        return 1
+
+    # get_time_array takes the text of the GUI fields, where "" is no end time
+    try:
+        time_array = get_time_array(str(args.start), "" if args.end is None else str(args.end), str(args.step))
+    except ValueError as err:
+        parser.error(f"--step: {err}")
+    if time_array is False:
+        parser.error("--step must divide evenly into the range from --start to --end")
+
+    output_options = [ OUTPUTS[output] for output in args.outputs ]
+    file_names = { "pdf": args.pdf_name, "mp4": args.mp4_name, "dat": args.dat_name, "kml": args.kml_name }
+    output_folder = os.path.join(args.output_dir, "")
+
+    figures = []
+    try:
+        if 1 in output_options or 2 in output_options:
+            from draw_map_gui import Figure
+            for projection in args.projection:
+                projection_option, proj_kwargs = figure_kwargs(args, projection)
+                figures.append(Figure(projection_option, **proj_kwargs))
+    except (OSError, ValueError) as err:
+        # bad --bounds
+        print(f"An Error occurred: {err}", file=sys.stderr)
+        return 1
+
+    job = PlateTrackerJob(args.rot, geo_files, time_array, output_options, file_names,
+                          figure=figures, fixed_plate=args.fixed_plate, output_folder=output_folder,
+                          fps=args.fps, report_file=args.report,
+                          profile=args.profile, workers=args.workers,
+                          resume=args.resume, kml_tolerance=args.kml_tolerance,
+                          single_pdf=args.single_pdf, keep_frames=args.keep_frames)
+    failures = []
+    job.on_error = lambda err: failures.append(err) or print(f"An Error occurred: {err}", file=sys.stderr)
+
+    try:
+        job.run()
+    except OutputFailed:
+        # raised on the frame after an output failed, which is already in failures
+        pass
+    except UserInterrupt:
+        pass
+    except (EOFError, ValueError, OSError) as err:
+        # OSError: a missing or unreadable rotation or geographic file
+        print(f"An Error occurred: {err}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        print(job.stats.summary())
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,12 @@
 import simplekml
 import matplotlib.colors
 
+import simplify
+
 class saveKML:
 
-    def __init__(self, kml_file):
+    def __init__(self, kml_file, tolerance=0.0):
+        self.tolerance = tolerance  # radians, see simplify
         file_extension = kml_file[-4:]
         if file_extension == ".kml":
             self.kml_file = kml_file
@@ -31,7 +34,11 @@ class saveKML:
             
             # Process records
             points = []
-            for record in chunk.records:
+            records = chunk.records
+            keep = simplify.keep_mask(chunk, self.tolerance)
+            if keep is not None:
+                records = [ record for record, kept in zip(records, keep) if kept ]
+            for record in records:
                 alat = record.alat
                 along = record.along
                 pen = record.pen
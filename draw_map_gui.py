@@ -1,22 +1,50 @@
 from matplotlib import pyplot as plt
-from matplotlib import rc_context as mplrc_context
 import numpy as np
 import cartopy.crs as ccrs
 import cartopy.mpl.patch as cmp
 from matplotlib.path import Path
 from matplotlib.patches import PathPatch
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PatchCollection, PathCollection
 from matplotlib.gridspec import GridSpec
 from matplotlib.colors import is_color_like, CSS4_COLORS, Normalize
-from matplotlib.animation import FFMpegWriter
 from matplotlib import rcParams as mplrcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.cm as mplcm
 import shapely.geometry
 import shapely.ops as ops
+import io
 import os
 import sys
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
 
 import timeline_colormap_creation as tcc
+import spherical_clip
+import simplify
+import instrumentation
+from instrumentation import timer
+
+@lru_cache(maxsize=None)
+def drawable_color(color):
+    """Whether matplotlib can draw color, checked once per color string or RGBA tuple."""
+    return is_color_like(color) and color != "1"
+
+def bucket_zorder(order):
+    """add_geometries' default zorder, nudged so a frame's buckets draw in their order."""
+    return 1.5 + order * 1e-6
+
+VECTOR_FORMATS = [ "svg", "eps", "ps" ]     # the PDF is its own output, so not an export
+RASTER_FORMATS = [ "png", "jpg", "jpeg", "tif", "tiff", "webp", "bmp" ]  # encoded by Pillow (see encode_image)
+PRINT_DPI = 300     # resolution vector output is simplified for, as it may be printed
+
+def encode_image(file_name, rgba, size, image_format):
+    """Writes raw RGBA as an image file. Run in threads, as Pillow lets go of the GIL while compressing."""
+    image = Image.frombuffer("RGBA", size, rgba, "raw", "RGBA", 0, 1)
+    if image_format in ("jpg", "jpeg"):
+        image = image.convert("RGB")    # no transparency in JPEG
+    image.save(file_name)
 
 class Figure:
 
@@ -25,14 +53,32 @@ class Figure:
         self.ax = None
         self.set_color_list()
         self.proj = proj_select
+        offscreen = kwargs.pop("offscreen", False)
+        self.kwargs = kwargs    # kept so worker processes can build the same map
 
         # animation fields
-        self.frame_count = 0
         if "fps" in kwargs: self.fps = kwargs["fps"]
 
         lat_space = kwargs["lat_spacing"]
         lon_space = kwargs["lon_spacing"]
 
+        # features are projected together at the end of each frame (see project_queued),
+        # clipped on the sphere to visible_cap on maps that only show part of the globe
+        self.project_fills = True
+        self.visible_cap = None
+        self.queued = []            # features waiting to be projected, as (lon, lat, start, closed)
+        self.queued_batches = []    # (queued feature indices, fill color, border color, layer, order in the frame)
+        self.bucket_artists = {}    # k: (layer, bucket number within the layer); v: PathCollection kept across frames
+        self.simplify = kwargs.get("simplify", True)   # leave out points too close together to see (see simplify)
+        # more files saved with each PDF, as (format, dpi), dpi None for vector formats or the figure's dpi
+        self.exports = [ tuple(export) for export in kwargs.get("exports", []) ]
+        for image_format, dpi in self.exports:
+            if image_format == "pdf":
+                raise ValueError("PDF is saved by the pdf output, it can't also be an image export")
+            if image_format not in VECTOR_FORMATS + RASTER_FORMATS:
+                raise ValueError(f"Can't export {image_format} images, choose from {', '.join(VECTOR_FORMATS + RASTER_FORMATS)}")
+        self.tolerance = None
+
         match self.proj:
             case 0:     # Rectilinear projection
                 self.set_Rectilinear(lat_space, lon_space, kwargs)
@@ -52,17 +98,49 @@ class Figure:
                 self.set_Azimuthal(lat_space, lon_space, kwargs)    
             case 8:     # Stereographic projection
                 self.set_Stereographic(lat_space, lon_space, kwargs)
+
+        # drawn from a worker thread: taken out of pyplot onto an Agg canvas, which
+        # no GUI event loop repaints while the worker changes it
+        if offscreen:
+            plt.close(self.fig)
+            FigureCanvasAgg(self.fig)
         
         self.fig.set_size_inches(15, 10)
         self.fig.tight_layout()
         self.fig.canvas.draw()
-        self.bg = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.view_cap = self.view_bounds()
+        self.bg = None      # cached background for blit_frame, redrawn when the layout changes
         # Get 2D vertices from boundary (drop z-coordinate if present)
         vertices = np.array(self.ax.projection.boundary.coords)[:,:2]  # Shape (N,2)
         
         # Convert to matplotlib Path
         self.clip_path = Path(vertices, closed=True)
 
+    def view_bounds(self):
+        """
+        A cap round everything the map shows, for culling features that can't be
+        seen (see PlateTrackerJob.cull), or None if the map shows most of the globe.
+        The edge of the axes is taken back to lon/lat, as set_extent can show
+        more than map_bounds once projected.
+        """
+        if self.visible_cap is not None:
+            return self.visible_cap
+        projection = self.ax.projection
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        t = np.linspace(0.0, 1.0, 60)
+        x = np.concatenate((x_min + t * (x_max - x_min), np.full(60, x_max), x_max - t * (x_max - x_min), np.full(60, x_min)))
+        y = np.concatenate((np.full(60, y_min), y_min + t * (y_max - y_min), np.full(60, y_max), y_max - t * (y_max - y_min)))
+        edge = ccrs.PlateCarree().transform_points(projection, x, y)[:, :2]
+        center_lon, center_lat = ccrs.PlateCarree().transform_point((x_min + x_max) / 2, (y_min + y_max) / 2, projection)
+        if not (np.isfinite(edge).all() and np.isfinite([center_lon, center_lat]).all()):
+            return None     # the axes reach past the edge of the globe
+        radius = np.degrees(np.arccos(np.clip(spherical_clip.to_xyz(edge[:, 0], edge[:, 1]) @
+                                              spherical_clip.to_xyz([center_lon], [center_lat])[0], -1.0, 1.0))).max()
+        if radius > 170:
+            return None
+        return spherical_clip.Cap(center_lon, center_lat, radius + 1.0)     # a degree to spare for the line widths
+
     def set_Mollweide(self, lat_space, lon_space, kwargs):
         self.fig, self.ax = plt.subplots(subplot_kw={'projection': ccrs.Mollweide(central_longitude=0)})
         self.ax.set_extent(kwargs["map_bounds"])
@@ -94,6 +172,7 @@ class Figure:
         self.fig, self.ax = plt.subplots(
             subplot_kw={'projection': ccrs.Orthographic(central_longitude=center_lon, central_latitude=center_lat)})
         self.ax.set_global()
+        self.visible_cap = spherical_clip.Cap(center_lon, center_lat, 89.99)   # just inside the horizon
         self.draw_gridlines(lat_space, lon_space, 'ortho')
 
     def set_Azimuthal(self, lat_space, lon_space, kwargs):
@@ -102,6 +181,7 @@ class Figure:
         self.fig, self.ax = plt.subplots(
             subplot_kw={'projection': ccrs.AzimuthalEquidistant(central_longitude=center_lon, central_latitude=center_lat)})
         self.ax.set_global()
+        self.visible_cap = spherical_clip.Cap(center_lon, center_lat, 179.0)   # geodesics on the ellipsoid break down nearer the antipode
         self.draw_gridlines(lat_space, lon_space, 'azim')
 
     def set_Transverse_Mercator(self, lat_space, lon_space, kwargs):
@@ -110,6 +190,7 @@ class Figure:
         self.fig, self.ax = plt.subplots(
             subplot_kw={'projection': ccrs.TransverseMercator(central_longitude=center_lon, central_latitude=center_lat)})
         self.ax.set_global()
+        self.project_fills = False  # no simple visible region, cartopy splits the fills
         self.draw_gridlines(lat_space, lon_space, 'trans')
 
     def set_Stereographic(self, lat_space, lon_space, kwargs):    
@@ -120,6 +201,11 @@ class Figure:
         else:
             self.fig, self.ax = plt.subplots(subplot_kw={'projection': ccrs.SouthPolarStereo(central_longitude=180)})
             self.ax.set_extent([-180, 180, -90, kwargs["min_lat"]], crs=ccrs.PlateCarree())
+
+        # the square extent shows beyond min_lat in its corners, sqrt(2) further out from the pole
+        radius = 90 - kwargs["min_lat"] if kwargs["north_hemi"] else 90 + kwargs["min_lat"]
+        radius = min(2 * np.degrees(np.arctan(np.sqrt(2) * np.tan(np.radians(radius) / 2))), 179.0)
+        self.visible_cap = spherical_clip.Cap(180, 90 if kwargs["north_hemi"] else -90, radius)
     
         # Draw gridlines
         self.draw_gridlines(lat_space, lon_space, 'stereo')
@@ -153,8 +239,11 @@ class Figure:
     def update_plot_vars(self, output_tuple, plot_time):
         self.output = output_tuple
         self.plot_time = plot_time
+        first_title = not self.ax.get_title(loc="left")
         self.ax.set_title(f"{plot_time}Ma", loc="left")
-        self.fig.tight_layout()
+        if first_title:     # later titles fit in the same space
+            self.fig.tight_layout()
+            self.bg = None
 
     def set_color_list(self):
        light_colors = [ "whitesmoke", "white", "snow", "mistyrose", "seashell", "linen", "bisque",
@@ -164,6 +253,11 @@ class Figure:
                          "ghostwhite", "lavender", "lavenderblush" ]
        all_colors = list(CSS4_COLORS)
        self.color_list = [color for color in all_colors if color not in light_colors]
+
+       # multicolor and byPlateId look plate colors up here, so a plate keeps its color from frame to frame
+       # (and in worker processes), and all its features can be drawn together
+       self.plate_palette = [ str(color) for color in np.random.default_rng(1).permutation(self.color_list) ]
+       self.plate_colors = {}  # k: plate id, or (layer, plate id) for multicolor; v: color name
        
        self.ocean_age_norm = Normalize(0, 250)
        self.ocean_age_cmap = mplcm.rainbow_r
@@ -173,16 +267,35 @@ class Figure:
        self.geo_age_cmap = tcc.smallest_division
        self.geo_age_colorbar = False
 
-    def check_if_special_color(self, color, age, plateid):
+       # the age colors, looked up once here: one RGBA tuple per geologic interval, and per step of the ocean colormap
+       self.geo_age_bounds = tcc.smallest_division_time
+       self.geo_age_lut = [ tuple(color) for color in self.geo_age_cmap(np.arange(self.geo_age_cmap.N)).tolist() ]
+       self.ocean_age_lut = [ tuple(color) for color in self.ocean_age_cmap(np.arange(self.ocean_age_cmap.N)).tolist() ]
+
+    def plate_color(self, plateid, layer=None):
+        """The color of plateid, the same in every file, or only within file layer if given."""
+        key = plateid if layer is None else (layer, plateid)
+        color = self.plate_colors.get(key)
+        if color is None:
+            index = (int(plateid) + 61 * (layer or 0)) % len(self.plate_palette)
+            color = self.plate_colors[key] = self.plate_palette[index]
+        return color
+
+    def check_if_special_color(self, color, age, plateid, layer=0):
         if color == "multicolor":
-            rand_index = np.random.randint(1, len(self.color_list))
-            color = self.color_list[rand_index]
+            color = self.plate_color(plateid, layer)
+        elif color == "byPlateId":
+            color = self.plate_color(plateid)
         elif color == "byGeoAge":
-            color = self.geo_age_cmap(self.geo_age_norm(age))
+            # ages before the first interval or after the last take its color, as with geo_age_norm
+            index = bisect_right(self.geo_age_bounds, age) - 1
+            color = self.geo_age_lut[min(max(index, 0), len(self.geo_age_lut) - 1)]
             self.geo_age_colorbar = True
         elif color == "byOceanAge":
             chunk_age = age - self.plot_time
-            color = self.ocean_age_cmap(self.ocean_age_norm(chunk_age))
+            norm = self.ocean_age_norm
+            step = (chunk_age - norm.vmin) / (norm.vmax - norm.vmin) * len(self.ocean_age_lut)
+            color = self.ocean_age_lut[int(min(max(step, 0), len(self.ocean_age_lut) - 1))]
             self.ocean_age_colorbar = True
 
         return color
@@ -225,6 +338,7 @@ class Figure:
         
         # Adjust layout to prevent overlap
         self.fig.tight_layout()
+        self.bg = None
         
     def process_records(self, records):
         # Build path with anti-meridian handling
@@ -250,136 +364,415 @@ class Figure:
 
         return vertices, codes    
 
-    def max_lat(self, list):
-        return max(list[0][1], list[-1][1]) # lats of first and last points
-    
-    def split_polygons(self, poly_list):
-        meridians = [0, 180, -180]
-        sections = [[]]
-        prev_meridian = False
-        cur_section = 0
-        
-        # Divide list by artificial meridian points
-        for point in poly_list:
-            lon = point[0]
-            if lon in meridians and prev_meridian:
-                sections.append([point])
-                cur_section += 1
-                prev_meridian = False
-            elif lon in meridians:
-                sections[cur_section].append(point)
-                prev_meridian = True
-            else:
-                sections[cur_section].append(point)
-                prev_meridian = False
-
-        # # combine first and last lists if there is a non-meridian starting point
-        if len(sections) > 1 and not (sections[0][0][0] in meridians):
-            [ sections[-1].append(point) for point in sections[0] ]
-            sections.pop(0)
-
-        # combine into polygons
-        complete = False
-        while not complete:
-            complete = True
-            sections.sort(reverse=True, key=self.max_lat)
-            for i, section in enumerate(sections[:-1]):
-                start_lat = min(section[0][1], section[-1][1])
-                end_lat = max(section[0][1], section[-1][1])
-                next_lat = sections[i + 1][0][1]
-                if start_lat < next_lat and next_lat < end_lat:
-                    if end_lat > start_lat:
-                        # if it crosses the pole, add polar points
-                        end_lon = sections[i][-1][0]
-                        start_lon = sections[i + 1][0][0]
-                        if end_lon != start_lon:
-                            pole_lat = 90 if start_lat > 0 else -90
-                            sections[i].append((end_lon, pole_lat))
-                            sections[i].append((start_lon, pole_lat))
-                        # combine sections
-                        [ sections[i].append(point) for point in sections[i + 1] ]
-                        sections.pop(i + 1)
-                    else:
-                        # if it crosses the pole, add polar points
-                        end_lon = sections[i + 1][-1][0]
-                        start_lon = sections[i][0][0]
-                        if end_lon != start_lon:
-                            pole_lat = 90 if start_lat > 0 else -90
-                            sections[i].append((end_lon, pole_lat))
-                            sections[i].append((start_lon, pole_lat))
-                        # combine sections
-                        [ sections[i + 1].append(point) for point in sections[i] ]
-                        sections.pop(i)
-                    complete = False
+    def ring_area(self, lon, lat):
+        """
+        Signed area of a closed ring in square degrees, positive if it runs
+        counterclockwise. Longitudes are unwrapped across the antimeridian, and a
+        ring that goes all the way round the globe is closed over the nearer pole.
+        """
+        step = (np.diff(lon) + 180) % 360 - 180
+        x = np.concatenate(([lon[0]], lon[0] + np.cumsum(step)))
+        y = lat
+        if abs(x[-1] - x[0]) > 180:
+            pole_lat = 90 if lat.mean() > 0 else -90
+            x = np.concatenate((x, [x[-1], x[0]]))
+            y = np.concatenate((y, [pole_lat, pole_lat]))
+        return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+    def split_polygons(self, sections, west, east):
+        """
+        Joins one hemisphere's sections into closed polygons. Each section runs
+        from the point where a counterclockwise ring enters the strip between the
+        west and east meridians to the point where it leaves again (see
+        process_polygons). From where a section leaves, the polygon follows the
+        edge of the strip counterclockwise to the next point where the ring comes
+        back in: straight along the same meridian, or over the pole to the other
+        one. The crossings are sorted once and each section is joined once.
+        """
+        def edge_position(point):
+            # distance counterclockwise round the edge of the strip from its south-west corner
+            lon, lat = point
+            if lon == east:
+                return 270 + lat
+            return 630 - lat
+
+        entries = sorted((edge_position(section[0]), i) for i, section in enumerate(sections))
+        entry_positions = [ position for position, i in entries ]
+
+        polygons = []
+        joined = [False] * len(sections)
+        for first in range(len(sections)):
+            if joined[first]: continue
+            parts = []
+            i = first
+            while True:
+                joined[i] = True
+                parts.append(sections[i])
+
+                # next entry counterclockwise, going past the south-west corner if need be
+                exit_lon = sections[i][-1][0]
+                k = bisect_left(entry_positions, edge_position(sections[i][-1])) % len(entries)
+                i = entries[k][1]
+                if joined[i] and i != first:
+                    break   # the ring crosses itself, close straight back to the first section
+                entry_lon = sections[i][0][0]
+                if exit_lon == east and entry_lon != east:
+                    parts.append([(east, 90), (west, 90)])
+                elif exit_lon != east and entry_lon == east:
+                    parts.append([(west, -90), (east, -90)])
+                if i == first:
                     break
 
-        # make each polygon completed
-        for i in range(len(sections)):
-            start_point = sections[i][0]
-            sections[i].append(start_point)
-            # if this creates a pole crossing, add polar points
-            if sections[i][-2][0] in meridians and sections[i][-2][0] != sections[i][-1][0]:
-                pole_lat = 90 if sections[i][-2][1] > 0 else -90
-                sections[i].insert(-1, (sections[i][-2][0], pole_lat))
-                sections[i].insert(-1, (sections[i][-1][0], pole_lat))
-    
-        return sections
+            parts.append(sections[first][:1])     # close the polygon
+            polygons.append(np.vstack(parts))
+
+        return polygons
     
-    def process_polygons(self, records):
-        positive = []
-        negative = []
-        prev_lon = records[0].along
-        prev_lat = records[0].alat
-        for record in records:
-            lat = record.alat
-            lon = record.along
-            # pen = record["pen"]
-
-            # integer values reserved for meridian points in splitting algorithm
-            if lon == 180: lon = 180.001
-            elif lon == -180: lon = -180.001
-            elif lon == 0 and prev_lon > 0: lon = 0.001
-            elif lon == 0 and prev_lon < 0: lon = -0.001
-
-            if prev_lon != 0 and lon/prev_lon < 0:
-                if abs(lon - prev_lon) > 180:
-                    mid_lon = 180 if prev_lon > 0 else -180
-                    # mid_lat = lat + (prev_lat - lat) * (mid_lon - prev_lon)/(lon - prev_lon)
-                    lon_dist = abs(mid_lon - prev_lon) + abs(-mid_lon - lon)
-                    lon_dist = -lon_dist if prev_lon < 0 else lon_dist
-                    mid_lat = prev_lat + (mid_lon - prev_lon) * (lat - prev_lat)/lon_dist
-                    positive.append((180, mid_lat))
-                    negative.append((-180, mid_lat))
-                else:
-                    mid_lat = prev_lat + (0 - prev_lon) * (lat - prev_lat)/(lon - prev_lon)
-                    positive.append((0, mid_lat))
-                    negative.append((0, mid_lat))
-            if lon > 0:
-                positive.append((lon, lat))
-            else:
-                negative.append((lon, lat))
-            
-            prev_lon = lon
-            prev_lat = lat
+    def ring_arrays(self, records, keep=None):
+        """Longitudes and latitudes of a polygon's records, or of those in keep, closed on the first point."""
+        n = len(records)
+        lon = np.fromiter([ record.along for record in records ], dtype=float, count=n)
+        lat = np.fromiter([ record.alat for record in records ], dtype=float, count=n)
+        if keep is not None:
+            lon, lat = lon[keep], lat[keep]
+        if lon[0] != lon[-1] or lat[0] != lat[-1]:
+            # gpml rings don't repeat their first point
+            lon = np.append(lon, lon[0])
+            lat = np.append(lat, lat[0])
+        return lon, lat
 
-        # delete duplicate point
-        if prev_lon > 0:
-            positive.pop(-1)
-        else:
-            negative.pop(-1)
-
-        if positive and negative:
-            pos_polys = self.split_polygons(positive)
-            neg_polys = self.split_polygons(negative)
-            [ pos_polys.append(poly) for poly in neg_polys ]
-            return pos_polys
-        elif positive:
-            positive.append(positive[0])
-            return [positive]
-        else:
-            negative.append(negative[0])
-            return [negative]
+    def hemisphere_crossings(self, lon):
+        """
+        Returns the hemisphere (1 or -1) of each point of a ring, with points on the
+        prime meridian staying with the point before them, and whether the ring
+        changes hemisphere between each point and the one before it.
+        """
+        side = np.sign(lon)
+        on_meridian = side == 0
+        if on_meridian.all():
+            side[:] = -1
+        elif on_meridian.any():
+            last_off = np.maximum.accumulate(np.where(on_meridian, -1, np.arange(len(lon))))
+            last_off[last_off < 0] = np.flatnonzero(~on_meridian)[-1]    # wrap around the ring
+            side = side[last_off]
+
+        crossing = np.zeros(len(lon), dtype=bool)
+        crossing[1:] = side[1:] != side[:-1]
+        return side, crossing
+
+    def process_polygons(self, records, keep=None):
+        """
+        Splits a polygon ring at the prime meridian and the antimeridian so it can
+        be filled in PlateCarree. The latitudes where the ring crosses 0 or 180 are
+        interpolated all at once, and each hemisphere's points are cut into
+        sections at those crossings with index arrays.
+        """
+        lon, lat = self.ring_arrays(records, keep)
+        n = len(lon)
+
+        side, crossing = self.hemisphere_crossings(lon)
+
+        # all in one hemisphere, close the ring on its first point
+        if not crossing.any():
+            ring = np.column_stack((lon, lat))
+            ring[-1] = ring[0]
+            return [ring]
+
+        # split_polygons assembles counterclockwise rings
+        if self.ring_area(lon, lat) < 0:
+            lon = lon[::-1]
+            lat = lat[::-1]
+            side, crossing = self.hemisphere_crossings(lon)
+
+        # only the crossings need a latitude, prev is the point before each one
+        index = np.flatnonzero(crossing)
+        lon1, lat1, side1 = lon[index - 1], lat[index - 1], side[index - 1]
+        lon2, lat2 = lon[index], lat[index]
+        dateline = np.abs(lon2 - lon1) > 180
+        # crossing latitude at 0, or at 180 measuring the longitude gap across the antimeridian
+        mid_lon = np.where(dateline, 180 * side1, 0)
+        lon_dist = np.where(dateline, (np.abs(mid_lon - lon1) + np.abs(mid_lon + lon2)) * side1, lon2 - lon1)
+        mid_lat = lat1 + np.divide((mid_lon - lon1) * (lat2 - lat1), lon_dist,
+                                   out=np.zeros(len(index)), where=lon_dist != 0)
+
+        # slot 2i is the crossing before point i, slot 2i + 1 is point i
+        slots = np.empty((2 * n, 2))
+        slots[1::2, 0] = lon
+        slots[1::2, 1] = lat
+        slots[2 * index, 1] = mid_lat
+        polygons = []
+        for hemisphere, west, east in ((1, 0, 180), (-1, -180, 0)):
+            slots[2 * index, 0] = np.where(dateline, 180 * hemisphere, 0)
+            keep = np.zeros(2 * n, dtype=bool)
+            keep[2 * index] = True
+            keep[1:-1:2] = side[:-1] == hemisphere     # the last point repeats the first
+            entry = np.zeros(2 * n, dtype=bool)
+            entry[2 * index] = side[index] == hemisphere
+
+            hemi_points = slots[keep]
+            cuts = np.flatnonzero(entry[keep]).tolist()
+            bounds = zip([0] + cuts, cuts + [len(hemi_points)])
+            sections = [ hemi_points[start:end] for start, end in bounds if end > start ]
+            if len(sections) > 1 and (len(cuts) == 0 or cuts[0] != 0):
+                # the ring started inside this hemisphere, so its first section continues the last
+                sections[-1] = np.vstack((sections[-1], sections.pop(0)))
+            polygons.extend(self.split_polygons(sections, west, east))
+        return polygons
         
+    def simple_rings(self, lon, lat):
+        """
+        Returns the polygon as counterclockwise (lon, lat) rings. Clipping on the
+        sphere has to know which side of a ring is inside, so a ring that crosses
+        itself is first broken into simple rings.
+        """
+        step = (np.diff(lon) + 180) % 360 - 180
+        x = np.concatenate(([lon[0]], lon[0] + np.cumsum(step)))     # unwrapped across the antimeridian
+        if len(x) > 3 and abs(x[-1] - x[0]) < 180:   # rings round a pole can't be checked in lon/lat
+            polygon = shapely.Polygon(np.column_stack((x, lat)))
+            if not polygon.is_valid:
+                rings = []
+                for part in shapely.get_parts(shapely.make_valid(polygon)):
+                    for piece in shapely.get_parts(part):
+                        if piece.geom_type == "Polygon":
+                            coords = np.asarray(shapely.geometry.polygon.orient(piece).exterior.coords)
+                            rings.append((coords[:, 0], coords[:, 1]))
+                return rings
+
+        if self.ring_area(lon, lat) < 0:
+            return [(lon[::-1], lat[::-1])]
+        return [(lon, lat)]
+
+    def fill_rings(self, records, keep=None):
+        """
+        Returns a polygon's fill as a list of (n, 2) lon/lat rings that can be
+        projected as they are. Maps of the whole globe split the ring at the
+        antimeridian (process_polygons), maps of a cap clip it on the sphere.
+        """
+        rings = []
+        if self.visible_cap is not None:
+            for lon, lat in self.simple_rings(*self.ring_arrays(records, keep)):
+                rings.extend(self.visible_cap.clip(*spherical_clip.densify(lon, lat)))
+        else:
+            for ring in self.process_polygons(records, keep):
+                lon, lat = spherical_clip.densify(ring[:, 0], ring[:, 1], wrap=False)
+                rings.append(np.column_stack((lon, lat)))
+        return rings
+
+    def line_arrays(self, records, keep=None):
+        """Longitudes, latitudes and pen-up mask of a line feature's records, or of those in keep, densified."""
+        n = len(records)
+        lon = np.fromiter([ record.along for record in records ], dtype=float, count=n)
+        lat = np.fromiter([ record.alat for record in records ], dtype=float, count=n)
+        start = np.fromiter([ record.pen != 2 for record in records ], dtype=bool, count=n)
+        if keep is not None:
+            lon, lat, start = lon[keep], lat[keep], start[keep]
+        start[0] = True
+        return spherical_clip.densify_lines(lon, lat, start)
+
+    def simplify_tolerance(self, samples=50):
+        """
+        Half a pixel, as an angle on the sphere, where the map stretches the most,
+        at the finest resolution the frame is shown or saved at (see output_dpi).
+        Points of a feature within that of its simplified outline are left out
+        (see simplify). The stretch is sampled on a grid over the map's extent,
+        its bounds included, as it grows toward the edges of most projections
+        (Mercator's poles, the rim of the azimuthal maps).
+        """
+        if not self.simplify:
+            return None
+        projection = self.ax.projection
+        geodetic = ccrs.PlateCarree()
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        dpi = self.output_dpi()
+        pixels = self.ax.get_position().width * self.fig.get_figwidth() * dpi
+        # the grid back to lon/lat, points off the globe come back non-finite
+        x, y = np.meshgrid(np.linspace(x_min, x_max, samples), np.linspace(y_min, y_max, samples))
+        lonlat = geodetic.transform_points(projection, x.ravel(), y.ravel())[:, :2]
+        lon, lat = lonlat[np.isfinite(lonlat).all(axis=1)].T
+        lat = np.clip(lat, -89.0, 89.0)
+        # map units per degree of arc: the largest stretch of a step east and a step north
+        # from each point, each taken forward or back, whichever doesn't cross the map's seam
+        step = 0.1
+        start = projection.transform_points(geodetic, lon, lat)[:, :2]
+        columns = []
+        for dlon, dlat in ((step / np.cos(np.radians(lat)), 0.0), (0.0, step)):
+            forward = projection.transform_points(geodetic, lon + dlon, lat + dlat)[:, :2] - start
+            back = start - projection.transform_points(geodetic, lon - dlon, lat - dlat)[:, :2]
+            shorter = np.hypot(*forward.T) <= np.hypot(*back.T)
+            columns.append(np.where(shorter[:, None], forward, back))
+        jacobian = np.stack(columns, axis=2) / step
+        jacobian = jacobian[np.isfinite(jacobian).all(axis=(1, 2))]
+        scale = np.linalg.norm(jacobian, ord=2, axis=(1, 2)).max(initial=0.0)
+        if not np.isfinite(scale) or scale <= 0:
+            return None
+        return np.radians(0.5 * (x_max - x_min) / pixels / scale)
+
+    def output_dpi(self):
+        """
+        The finest resolution of the frame's outputs: the screen and animation,
+        PRINT_DPI for the PDF and vector exports, and each raster export.
+        """
+        dpi = [ self.fig.dpi, mplrcParams['figure.dpi'] ]
+        if self.output["save"]:
+            dpi.append(PRINT_DPI)
+            dpi += [ export_dpi or mplrcParams['figure.dpi'] for image_format, export_dpi in self.exports ]
+        return max(dpi)
+
+    def queue_feature(self, lon, lat, start, closed):
+        """Keeps a feature's points until project_queued and returns its index in the frame."""
+        self.queued.append((lon, lat, start, closed))
+        return len(self.queued) - 1
+
+    def queue_rings(self, rings):
+        lengths = [ len(ring) for ring in rings ]
+        points = np.vstack(rings)
+        start = np.zeros(len(points), dtype=bool)
+        start[np.cumsum(lengths) - lengths] = True
+        return self.queue_feature(points[:, 0], points[:, 1], start, True)
+
+    def break_lines(self, lon, lat, start, feature, closed):
+        """
+        Breaks the frame's lines where they leave the map: at the edge of the
+        visible cap, where a point is added and the points beyond it dropped, or
+        where they cross the antimeridian, where a point is added on each side of
+        it. Fill rings are already split.
+        """
+        if self.visible_cap is not None:
+            # on the globe maps, lines end at the horizon rather than at their last visible point
+            visible = self.visible_cap.contains(lon, lat) | closed
+            crossing = np.zeros(len(lon), dtype=bool)
+            crossing[1:] = (visible[1:] != visible[:-1]) & ~start[1:] & ~closed[1:]
+            index = np.flatnonzero(crossing)
+            if len(index):
+                edge_lon, edge_lat = self.visible_cap.edge_crossings(lon, lat, index)
+                entering = visible[index]
+                lon = np.insert(lon, index, edge_lon)
+                lat = np.insert(lat, index, edge_lat)
+                start = np.insert(start, index, entering)   # a line coming back into view starts on the edge
+                feature = np.insert(feature, index, feature[index])
+                closed = np.insert(closed, index, False)
+                visible = np.insert(visible, index, True)
+            start = start.copy()
+            start[1:] |= ~visible[:-1]
+            return lon[visible], lat[visible], start[visible], feature[visible], closed[visible]
+
+        lon = np.where(closed, lon, (lon + 180) % 360 - 180)    # fills keep their edges at +180
+        crossing = np.zeros(len(lon), dtype=bool)
+        crossing[1:] = ~closed[1:] & ~start[1:] & (np.abs(np.diff(lon)) > 180)
+        index = np.flatnonzero(crossing)
+        if len(index) == 0:
+            return lon, lat, start, feature, closed
+
+        edge = np.where(lon[index - 1] > 0, 180.0, -180.0)
+        t = (edge - lon[index - 1]) / (lon[index] + 2 * edge - lon[index - 1])
+        seam_lat = lat[index - 1] + t * (lat[index] - lat[index - 1])
+        at = np.repeat(index, 2)
+        return (np.insert(lon, at, np.column_stack((edge, -edge)).ravel()),
+                np.insert(lat, at, np.repeat(seam_lat, 2)),
+                np.insert(start, at, np.tile([False, True], len(index))),
+                np.insert(feature, at, feature[at]),
+                np.insert(closed, at, False))
+
+    def break_jumps(self, xy, start, feature, closed):
+        """
+        Breaks projected lines where the projection tears them: points it can't
+        project onto the map are dropped, and a line that jumps more than a quarter
+        of the way across the map starts again, as on Transverse Mercator.
+        """
+        x_min, x_max = self.ax.projection.x_limits
+        y_min, y_max = self.ax.projection.y_limits
+        with np.errstate(invalid="ignore"):
+            projected = closed | ((xy[:, 0] >= x_min) & (xy[:, 0] <= x_max) & (xy[:, 1] >= y_min) & (xy[:, 1] <= y_max))
+        start = start.copy()
+        start[1:] |= ~projected[:-1]
+        xy, start, feature, closed = xy[projected], start[projected], feature[projected], closed[projected]
+
+        step = np.hypot(*np.diff(xy, axis=0).T)
+        start[1:] |= ~closed[1:] & (step > (x_max - x_min) / 4)
+        return xy, start, feature, closed
+
+    def project_queued(self):
+        """
+        Projects every feature queued this frame with one transform_points call,
+        splits the result back into a Path per feature and puts each batch in a
+        PathCollection. The collections are kept from frame to frame, and only
+        their paths, colors and order change.
+        """
+        if not self.queued:
+            self.queued_batches.clear()
+            for collection in self.bucket_artists.values():
+                collection.set_visible(False)
+            return
+
+        with timer("bulk projection"):
+            lengths = [ len(lon) for lon, lat, start, closed in self.queued ]
+            lon = np.concatenate([ f[0] for f in self.queued ])
+            lat = np.concatenate([ f[1] for f in self.queued ])
+            start = np.concatenate([ f[2] for f in self.queued ])
+            feature = np.repeat(np.arange(len(lengths)), lengths)
+            closed = np.repeat([ f[3] for f in self.queued ], lengths)
+            lon, lat, start, feature, closed = self.break_lines(lon, lat, start, feature, closed)
+
+            projection = self.ax.projection
+            xy = projection.transform_points(ccrs.PlateCarree(), lon, lat)[:, :2]
+            xy, start, feature, closed = self.break_jumps(xy, start, feature, closed)
+            # poles are infinitely far away on Mercator
+            xy[:, 0] = np.clip(xy[:, 0], *projection.x_limits)
+            xy[:, 1] = np.clip(xy[:, 1], *projection.y_limits)
+
+            codes = np.where(start, Path.MOVETO, Path.LINETO).astype(Path.code_type)
+            ends = np.ones(len(start), dtype=bool)
+            ends[:-1] = start[1:] | (feature[1:] != feature[:-1])
+            codes[ends & closed] = Path.CLOSEPOLY
+            bounds = np.searchsorted(feature, np.arange(len(lengths) + 1))
+        instrumentation.count("projected vertices", len(xy))
+
+        with timer("add_paths"):
+            used = {}   # k: layer; v: buckets drawn from it so far
+            for features, fill_color, border_color, layer, order in self.queued_batches:
+                if fill_color == "none":
+                    # lines don't overlap the way fills can, so the batch is one path
+                    points = np.concatenate([ xy[bounds[i]:bounds[i + 1]] for i in features ])
+                    path_codes = np.concatenate([ codes[bounds[i]:bounds[i + 1]] for i in features ])
+                    paths = [ Path(points, path_codes) ] if len(points) else []
+                else:
+                    paths = [ Path(xy[bounds[i]:bounds[i + 1]], codes[bounds[i]:bounds[i + 1]])
+                              for i in features if bounds[i + 1] > bounds[i] ]
+
+                slot = (layer, used.get(layer, 0))
+                used[layer] = slot[1] + 1
+                collection = self.bucket_artists.get(slot)
+                if collection is None:
+                    collection = PathCollection([], transform=self.ax.transData)
+                    collection.set_clip_path(self.ax.patch)
+                    self.ax.add_collection(collection, autolim=False)
+                    self.bucket_artists[slot] = collection
+                collection.set_paths(paths)
+                collection.set_facecolor(fill_color)
+                collection.set_edgecolor(border_color)
+                collection.set_zorder(bucket_zorder(order))
+                collection.set_visible(True)
+
+            for slot, collection in self.bucket_artists.items():
+                if used.get(slot[0], 0) <= slot[1]:
+                    collection.set_visible(False)
+        self.queued.clear()
+        self.queued_batches.clear()
+
+    def add_shapes(self, shapes, features, fill_color, border_color, layer=0, order=0):
+        """
+        Draws one batch of same-colored shapely shapes, and queues the batch's
+        projected features. order is the batch's place in the frame, which sets
+        the zorder of both, so later files draw over earlier ones.
+        """
+        if shapes:
+            with timer("add_geometries"):
+                self.ax.add_geometries(shapes, crs=ccrs.PlateCarree(), facecolor=fill_color, edgecolor=border_color,
+                                       zorder=bucket_zorder(order))
+        if features:
+            self.queued_batches.append((list(features), fill_color, border_color, layer, order))
+
     # def path_to_records(self, path):
     #     records = []
     #     for point in path.vertices:
@@ -388,76 +781,68 @@ class Figure:
     #     return records
 
     def plot_to_screen(self, chunk_generator):
-        for coll in self.ax.collections:
-            coll.remove()
-        for patch in self.ax.patches:
+        # the bucket collections are reused, anything else drawn last frame goes
+        retained = set(self.bucket_artists.values())
+        for coll in list(self.ax.collections):
+            if coll not in retained:
+                coll.remove()
+        for patch in list(self.ax.patches):
             patch.remove()
-        self.fig.canvas.restore_region(self.bg)
         
-        shapes = []
-        collectable = True
-        first_loop = True
-        border_color = "none"
-        fill_color = "none"
+        # everything of one style in one file is drawn together, as one artist:
+        # k: (layer, border color, fill color); v: (shapely shapes, features queued for project_queued)
+        buckets = {}
+        self.queued.clear()
+        self.queued_batches.clear()
+        self.tolerance = self.simplify_tolerance()
 
         one_by_one = False  # only for troubleshooting
         
         for chunk in chunk_generator:
+            if self in chunk.hidden_from:
+                yield chunk
+                continue
             
              # read in border color
-            color = self.check_if_special_color(chunk.border_color, chunk.appears, chunk.plateid)
-            if not is_color_like(color) or color == "1":
+            bcolor = self.check_if_special_color(chunk.border_color, chunk.appears, chunk.plateid, chunk.layer)
+            if not drawable_color(bcolor):
                 bcolor = "black"
-            else:
-                bcolor = color
 
             # read in fill color
-            color = self.check_if_special_color(chunk.fill_color, chunk.appears, chunk.plateid)
-            if not is_color_like(color) or color == "1" or len(chunk.records) < 3:
+            fcolor = self.check_if_special_color(chunk.fill_color, chunk.appears, chunk.plateid, chunk.layer)
+            if not drawable_color(fcolor) or len(chunk.records) < 3:
                 fcolor = "none"
-            else:
-                fcolor = color
-
-            # determine collectability
-            if bcolor != border_color or fcolor != fill_color:
-                if first_loop: 
-                    first_loop = False
-                    border_color = bcolor
-                    fill_color = fcolor
-                else: 
-                    collectable = False
-
-            # if it is not collectable anymore, plot everything collected and start over
-            if not collectable and shapes: # len(shapes) > 50
-                self.ax.add_geometries(shapes, crs=ccrs.PlateCarree(), facecolor=fill_color, edgecolor=border_color)
-                border_color = bcolor
-                fill_color = fcolor
-
-                # plt.draw()  # Force immediate render
-                # self.fig.canvas.flush_events()  # Process pending GUI events
-                # plt.pause(0.001)  # Allow GUI event processing
-                # one_by_one = True
-                # print("plot many")
 
-                # reset variables
-                shapes.clear()
-                collectable = True
-            
+            shapes, features = buckets.setdefault((chunk.layer, bcolor, fcolor), ([], []))
+            keep = simplify.keep_mask(chunk, self.tolerance)
+            if keep is not None:
+                instrumentation.count("vertices simplified away", int(len(keep) - np.count_nonzero(keep)))
+
             # finish creating next shape
-            if fill_color != "none":
-                polygon_list = self.process_polygons(chunk.records)
+            shape_list = []
+            if fcolor == "none":
+                with timer("line arrays"):
+                    features.append(self.queue_feature(*self.line_arrays(chunk.records, keep), False))
+            elif self.project_fills:
+                with timer("polygon clipping"):
+                    rings = self.fill_rings(chunk.records, keep)
+                if rings:
+                    features.append(self.queue_rings(rings))
+            else:
+                with timer("polygon splitting"):
+                    polygon_list = self.process_polygons(chunk.records, keep)
                 try:
-                    shape_list = [ shapely.Polygon(poly) for poly in polygon_list ]
+                    with timer("shapely construction"):
+                        shape_list = [ shapely.Polygon(poly) for poly in polygon_list ]
                 except ValueError:
                     print("unresolvable polygon, trying again as lines")
+                    instrumentation.count("polygon fallbacks")
                     vertices, codes = self.process_records(chunk.records)
-                    shape_list = cmp.path_to_geos(Path(vertices, codes))
-            else:
-                vertices, codes = self.process_records(chunk.records)
-                shape_list = cmp.path_to_geos(Path(vertices, codes))
+                    with timer("shapely construction"):
+                        shape_list = cmp.path_to_geos(Path(vertices, codes))
 
             # Add shape to list
-            [ shapes.append(shape) for shape in shape_list ]
+            shapes.extend(shape_list)
 
             yield chunk
             
@@ -466,7 +851,7 @@ class Figure:
                 print("next iter")
                 vertices, codes = self.process_records(chunk.records)
                 path = Path(vertices, codes)
-                self.ax.add_geometries(shapes, crs=ccrs.PlateCarree(), facecolor=fill_color, edgecolor=border_color)
+                self.ax.add_geometries(shape_list, crs=ccrs.PlateCarree(), facecolor=fcolor, edgecolor=bcolor)
                 print("PATH")
                 print(path)
                 plt.draw()  # Force immediate render
@@ -474,12 +859,13 @@ class Figure:
                 # plt.pause(0.001)  # Allow GUI event processing
                 plt.pause(0.5)
                 one_by_one = True
-                shapes.clear()
 
-        # plot everything that hasn't been plotted
-        if shapes:
-            self.ax.add_geometries(shapes, crs=ccrs.PlateCarree(), facecolor=fill_color, edgecolor=border_color)
-            # pass
+        # draw the buckets file by file, in the order their styles first appeared
+        ordered = sorted(buckets.items(), key=lambda b: b[0][0])
+        for order, ((layer, border_color, fill_color), (shapes, features)) in enumerate(ordered):
+            self.add_shapes(shapes, features, fill_color, border_color, layer, order)
+        instrumentation.count("style buckets", len(buckets))
+        self.project_queued()
         if not hasattr(self, 'gs'):
             self.add_colorbars()
     
@@ -1429,20 +1815,129 @@ class Figure:
     #endregion 
         
         # print(self.output)
-        if self.output["anim"]:
-            png_name = ".anim" + str(self.frame_count) + ".png"
-            self.fig.savefig(png_name, bbox_inches='tight', pad_inches=0.1)
-            self.frame_count += 1
         if self.output["plot"]:
-            plt.draw()  # Force immediate render
-            self.fig.canvas.flush_events()  # Process pending GUI events
-            plt.pause(0.5)  # Allow GUI event processing
+            with timer("screen drawing"):
+                self.show_frame()
         if self.output["save"]:
             pdf_name = self.output["save"] + ".pdf"
-            plt.savefig(pdf_name, format='pdf')
+            with timer("savefig"):
+                if self.output.get("pages") is not None:
+                    self.output["pages"].savefig(self.fig)  # the next page of the series' PDF
+                else:
+                    self.fig.savefig(pdf_name, format='pdf')   # not plt.savefig, another figure may be current
+            if self.exports:
+                self.save_exports(self.output["save"])
 
-    def make_animation(self, anim_name, frame_rate): 
+    def export_names(self, base_name):
+        """The files save_exports writes for base_name, in the order of self.exports."""
+        names = []
+        for image_format, dpi in self.exports:
+            if image_format in VECTOR_FORMATS:
+                names.append(f"{base_name}.{image_format}")
+            else:
+                names.append(f"{base_name}_{dpi or mplrcParams['figure.dpi']:g}dpi.{image_format}")
+        return names
 
+    def save_exports(self, base_name):
+        """
+        Saves the frame just drawn as each of self.exports, from the same artists
+        as the PDF. Each raster size is drawn to RGBA in turn, since matplotlib
+        only draws on one thread, and the images are compressed in a thread pool
+        while the next size is drawn.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(4, os.cpu_count() or 1))) as pool:
+            encoding = []
+            for (image_format, dpi), file_name in zip(self.exports, self.export_names(base_name)):
+                if image_format in VECTOR_FORMATS:
+                    with timer("savefig"):
+                        self.fig.savefig(file_name, format=image_format)
+                    continue
+                dpi = dpi or mplrcParams['figure.dpi']
+                buffer = io.BytesIO()
+                with timer("image export"):
+                    self.fig.savefig(buffer, format="rgba", dpi=dpi)
+                rgba = buffer.getvalue()
+                width = int(self.fig.get_figwidth() * dpi)     # Agg drops the fraction of a pixel
+                size = (width, len(rgba) // (4 * width))
+                encoding.append(pool.submit(encode_image, file_name, rgba, size, image_format))
+            with timer("image encoding"):
+                for future in encoding:
+                    future.result()     # raises any error from the thread
+
+    def show_frame(self):
+        """
+        Puts the finished frame on screen. Replaced by the GUI worker, which sends
+        the pixels of an off screen figure to the window instead.
+        """
+        self.blit_frame()
+        self.fig.canvas.flush_events()  # Process pending GUI events
+        plt.pause(0.001)  # Allow GUI event processing
+
+    def blit_frame(self):
+        """
+        Draws the frame on the canvas from cached bitmaps: the background (the
+        figure, the map's background and any colorbars) is restored, the frame's
+        features are drawn over it, then the overlay (gridlines, labels and the
+        map's frame) and the title. The bitmaps are drawn again after the layout
+        or the window size changes.
+        """
+        canvas = self.fig.canvas
+        if not getattr(canvas, "supports_blit", False):
+            canvas.draw()
+            return
+        if self.bg is None or self.bg_size != canvas.get_width_height():
+            self.cache_background()
+
+        canvas.restore_region(self.bg)
+        features = sorted(self.ax.collections, key=lambda artist: artist.get_zorder())
+        for artist in features:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+        renderer = canvas.get_renderer()
+        gc = renderer.new_gc()
+        renderer.draw_image(gc, 0, 0, self.overlay)
+        gc.restore()
+        self.ax.draw_artist(self.ax._left_title)
+        canvas.blit(self.fig.bbox)
+
+    def cache_background(self):
+        """
+        Draws the parts of the figure that stay the same from frame to frame.
+        Axes leave out animated artists when drawing on screen, which also keeps
+        the gridliners from drawing, even though they ignore being hidden.
+        """
+        canvas = self.fig.canvas
+        overlay = [ artist for artist in self.ax.get_children() if artist is not self.ax.patch ]
+        dynamic = list(self.ax.collections) + [ self.ax._left_title ]
+
+        for artist in overlay:
+            artist.set_animated(True)
+        canvas.draw()
+        self.bg = canvas.copy_from_bbox(self.fig.bbox)
+        self.bg_size = canvas.get_width_height()
+        for artist in overlay:
+            artist.set_animated(artist in dynamic)
+
+        # the overlay on a transparent background, flipped for draw_image
+        hidden = [ self.fig.patch, self.ax.patch ] + [ ax for ax in self.fig.axes if ax is not self.ax ]
+        for artist in hidden:
+            artist.set_visible(False)
+        canvas.draw()
+        self.overlay = np.asarray(canvas.buffer_rgba())[::-1].copy()
+        for artist in hidden:
+            artist.set_visible(True)
+        for artist in dynamic:
+            artist.set_animated(False)
+
+    def frame_rgba(self):
+        """The finished frame as raw RGBA bytes, for animation.FrameAssembler, and its (width, height)."""
+        buffer = io.BytesIO()
+        with timer("animation frames"):
+            self.fig.savefig(buffer, format="rgba", dpi=mplrcParams['figure.dpi'])
+        width, height = self.fig.get_size_inches() * mplrcParams['figure.dpi']
+        return buffer.getvalue(), (int(round(width)), int(round(height)))
+
+    def ffmpeg_path(self):
         # Configure FFmpeg path for PyInstaller bundles
         ffmpeg_path = mplrcParams['animation.ffmpeg_path']
         if getattr(sys, 'frozen', False):
@@ -1452,25 +1947,4 @@ class Figure:
             # Verify the binary exists and is executable
             if not os.path.exists(ffmpeg_path):
                 raise FileNotFoundError(f"FFmpeg not found at {ffmpeg_path}")
-            
-            # This is the critical line - sets the path matplotlib will use
-            # mplrcParams['animation.ffmpeg_path'] = ffmpeg_path
-        print(f"FFmpeg using path: {ffmpeg_path}")
-        
-        with mplrc_context({'animation.ffmpeg_path': ffmpeg_path}):
-            writer = FFMpegWriter(fps=frame_rate, bitrate=5000)
-            fig = plt.figure(frameon=False, layout='constrained')
-            height_pix, width_pix = plt.imread(".anim0.png").shape[:2]
-            width = width_pix / fig.get_dpi()
-            height = height_pix / fig.get_dpi()
-            print(f"{width, height}")
-            fig.set_size_inches(width, height, forward=True) # need to set fig to be same aspect as pngs
-            
-            with writer.saving(fig, anim_name, dpi=300):
-                for i in range(self.frame_count):
-                    img = plt.imread(f".anim{i}.png")
-                    os.remove(f".anim{i}.png")
-                    plt.imshow(img)
-                    plt.axis('off')
-                    writer.grab_frame()
-                    plt.clf()
+        return ffmpeg_path
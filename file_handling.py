@@ -1,14 +1,14 @@
 import csv
+import json
 import os
 os.environ["QT_API"] = "pyside6"
-import pygplates
 import os.path
 import sys
-from matplotlib.colors import is_color_like
 from dataclasses import dataclass
 from typing import List
 
-import symbols
+# pygplates, matplotlib and symbols (cartopy, shapely) are imported where they are
+# first used, so the window opens and DAT-only runs start without loading them
 
 @dataclass
 class Record:
@@ -33,8 +33,38 @@ class Chunk:
     size: float
     azimuth: float
     records: List[Record]
+    layer: int = 0      # position of the chunk's file in the project, files are drawn in order
+    significance: object = None     # per record, for drawing at a lower level of detail (see simplify)
+    bounding_cap: object = None     # (center unit vector, radius) round the unrotated records (see simplify)
+    hidden_from: tuple = ()         # the figures that can't show the chunk (see PlateTrackerJob.cull)
+
+def read_project_file(proj_file):
+    """
+    Returns the files listed in a project .json as [checked, arrows, path, border color,
+    fill color] rows, in project order. Paths are relative to the project file.
+    """
+    rows = []
+    file_list = json.load(open(proj_file, 'r'))
+
+    for file in file_list:
+        json_path = os.path.dirname(proj_file)
+        file_path = json_path + "/" + file["file"]
+        if not os.path.exists(file_path):
+            print(f"Could not find {file_path}")
+            continue
+
+        border_color = file["bcolor"]
+        fill_color = file["fcolor"]
+        if os.path.splitext(file_path)[1] == ".csv":
+            border_color = fill_color = "infile"
+        rows.append([file["checked"], False, file_path, border_color, fill_color])
+        json_file = file["file"]
+        print(f"in project: {json_file}")
+
+    return rows
 
 def read_csv_in_chunks(csv_file, plot_time, bcolor, fcolor):
+    import symbols
 
     # load symbols in memory
     shape_library = "shape_library.csv"
@@ -156,6 +186,8 @@ def read_file_in_chunks(filename, bcolor, fcolor):
     """
     Generator that reads the file in plate sized chunks, yielding one chunk at a time.
     """
+    from matplotlib.colors import is_color_like
+    from symbols import Shapes
     with open(filename, "r") as infile:
         while True:           
             # Read the first header
@@ -166,17 +198,17 @@ def read_file_in_chunks(filename, bcolor, fcolor):
 
             if len(h1) == 8:
                 label = h1[2]
-                symbol = h1[3] if h1[3] in symbols.Shapes else "none"
+                symbol = h1[3] if h1[3] in Shapes else "none"
                 if is_color_like(h1[4]):
                     border_color = h1[4]
-                elif h1[4] == "multicolor":
-                    border_color = "multicolor"
+                elif h1[4] in ("multicolor", "byPlateId"):
+                    border_color = h1[4]
                 else:
                     border_color = "black"
                 if is_color_like(h1[5]):
                     fill_color = h1[5]
-                elif h1[5] == "multicolor":
-                    fill_color = "multicolor"
+                elif h1[5] in ("multicolor", "byPlateId"):
+                    fill_color = h1[5]
                 else:
                     fill_color = "none"
                 try: 
@@ -236,6 +268,7 @@ def read_file_in_chunks(filename, bcolor, fcolor):
             yield chunk
 
 def assign_feature_type(gpml_feature):
+    import pygplates
     match gpml_feature:
         case pygplates.FeatureType.gpml_mid_ocean_ridge:
             return "SS"
@@ -255,6 +288,7 @@ def assign_feature_type(gpml_feature):
             return "UN" # Put GN somewhere
 
 def read_gpml_in_chunks(filename, plot_time, bcolor, fcolor):
+    import pygplates
 
     col = pygplates.FeatureCollection(filename)
 
@@ -278,13 +312,12 @@ def read_gpml_in_chunks(filename, plot_time, bcolor, fcolor):
                                  "plateid2": plateid2, "border_color": bcolor, "fill_color": fcolor, "record_number": 0},
                      "records": []}
         
-        chunk = Chunk(file_type, plateid, appears, disappears, feature_type, 0, plateid2, 
-                          bcolor, fcolor, 0, "nolabel", "none", 1, 0, [])
-
         geometry = feature.get_geometries()
         if geometry:
             for segment in geometry:
-                chunk.records = []
+                # a chunk per geometry, later stages may hold on to chunks
+                chunk = Chunk(file_type, plateid, appears, disappears, feature_type, 0, plateid2, 
+                              bcolor, fcolor, 0, "nolabel", "none", 1, 0, [])
                 points = list(segment.to_lat_lon_list())
                 if type(segment) is pygplates.PolygonOnSphere:
                     points.append(points[0])
@@ -307,19 +340,24 @@ def read_gpml_in_chunks(filename, plot_time, bcolor, fcolor):
                 yield chunk
 
 def read_files(files, plot_time):
-    for total_file in files:
-        _, _, file, border_color, fill_color = total_file
-        if border_color == "infile": border_color = ""
-        if fill_color == "infile": fill_color = ""
-        extension = os.path.splitext(file)[1]
-        match extension:
-            case ".csv":
-                for chunk in read_csv_in_chunks(file, plot_time, border_color, fill_color):
-                    yield chunk
-            case ".dat":
-                dat = sanitize_dat(file, plot_time)
-                for chunk in read_file_in_chunks(dat, border_color, fill_color):
-                    yield chunk
-            case ".gpml":
-                for chunk in read_gpml_in_chunks(file, plot_time, border_color, fill_color):
-                    yield chunk
\ No newline at end of file
+    for layer, total_file in enumerate(files):
+        for chunk in read_one_file(total_file, plot_time):
+            chunk.layer = layer
+            yield chunk
+
+def read_one_file(total_file, plot_time):
+    _, _, file, border_color, fill_color = total_file
+    if border_color == "infile": border_color = ""
+    if fill_color == "infile": fill_color = ""
+    extension = os.path.splitext(file)[1]
+    match extension:
+        case ".csv":
+            for chunk in read_csv_in_chunks(file, plot_time, border_color, fill_color):
+                yield chunk
+        case ".dat":
+            dat = sanitize_dat(file, plot_time)
+            for chunk in read_file_in_chunks(dat, border_color, fill_color):
+                yield chunk
+        case ".gpml":
+            for chunk in read_gpml_in_chunks(file, plot_time, border_color, fill_color):
+                yield chunk
\ No newline at end of file
@@ -6,7 +6,8 @@ from PySide6.QtGui import QPainter, QPen, QBrush
 import os.path
 import glob
 import sys
-import json
+
+from file_handling import read_project_file
 
 class ArrowDelegate(QStyledItemDelegate):
     def __init__(self, parent=None):
@@ -191,20 +192,8 @@ class FileTableModel(QAbstractTableModel):
             self.remove_row(0)
 
         # add files in project file
-        file_list = json.load(open(proj_file, 'r'))
-        
-        for file in file_list:
-            json_path = os.path.dirname(proj_file)
-            file_path = json_path + "/" + file["file"]
-            try:
-                # add files defined in project to gui
-                self.add_file(file_path, file["checked"], file["bcolor"], file["fcolor"])
-                json_file = file["file"]
-                print(f"in project: {json_file}")
-
-            except FileNotFoundError:
-                print(f"Could not find {file_path}")
-                continue
+        for checked, _, file_path, border_color, fill_color in read_project_file(proj_file):
+            self.add_file(file_path, checked, border_color, fill_color)
     
     def rowCount(self, parent=None):
         return len(self.files)
@@ -1,26 +1,103 @@
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton,
     QFileDialog, QMessageBox, QComboBox, QRadioButton, QButtonGroup, QTableView,
-    QAbstractItemView, QHeaderView, QCheckBox, QApplication, QStatusBar, QProgressBar
+    QAbstractItemView, QHeaderView, QCheckBox, QStatusBar, QProgressBar
     )
-from PySide6.QtGui import QIntValidator, QDoubleValidator, QIcon
-from PySide6.QtCore import Qt
+from PySide6.QtGui import QIntValidator, QDoubleValidator, QIcon, QImage, QPixmap
+from PySide6.QtCore import Qt, QObject, QThread, Signal, Slot
 
 import os
 import traceback
 import sys
-import numpy as np
 
-import file_handling
-import matplotlib.pyplot as plt
 from geo_file_table import CheckBoxDelegate, ArrowDelegate, FileTableModel
-from draw_map_gui import Figure
-from create_kml import saveKML
-from create_dat import saveDAT
-from rotation_engine_class import RotationEngine
-
-class UserInterrupt(Exception):
-    pass
+from pipeline import PlateTrackerJob, UserInterrupt, OutputFailed, PROJECTIONS, get_time_array, get_output_folder
+
+class PipelineWorker(QObject):
+    """
+    Runs a PlateTrackerJob on a QThread and reports back to the window through
+    signals. The figure is off screen and only touched by the worker: frame_ready
+    carries a copy of each finished frame's pixels to the window.
+    """
+    frame_started = Signal(int, int, float)
+    chunk_processed = Signal(int)
+    frame_ready = Signal(bytes, int, int)
+    succeeded = Signal(str)
+    failed = Signal(str, str)
+    halted = Signal()
+    stats_updated = Signal(str)
+    finished = Signal()
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        job.on_frame = self.frame_started.emit
+        job.on_chunk = self.chunk_processed.emit
+        job.on_success = self.succeeded.emit
+        job.on_error = self.report_error
+        job.on_stats = self.stats_updated.emit
+        if job.figure is not None:
+            job.figure.show_frame = self.show_frame
+
+    def show_frame(self):
+        canvas = self.job.figure.fig.canvas
+        self.job.figure.blit_frame()
+        width, height = canvas.get_width_height()
+        self.frame_ready.emit(bytes(canvas.buffer_rgba()), width, height)
+
+    def report_error(self, err):
+        print_error_to_terminal(err)
+        self.job.stop()
+        self.failed.emit("An Error occurred:", str(err))
+
+    @Slot()
+    def run(self):
+        try:
+            self.job.run()
+        except OutputFailed:
+            pass    # already reported by report_error
+        except UserInterrupt:
+            print("User halted program")
+            self.halted.emit()
+        except (EOFError, ValueError) as err:
+            self.report_error(err)
+        except Exception as err:
+            print_error_to_terminal(err)
+            self.job.stop()
+            self.failed.emit("An Error occurred:",
+                             "A bug has been found or there is an error in an input file. " \
+                             "Please change parameters and try again.")
+        finally:
+            self.finished.emit()
+
+class FrameView(QLabel):
+    """Window for the plot output, showing the frames the worker draws scaled to fit."""
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("PaleoMapper")
+        self.setAlignment(Qt.AlignCenter)
+        self.setMinimumSize(300, 200)
+        self.resize(900, 600)
+        self.frame = None
+
+    def show_image(self, rgba, width, height):
+        self.frame = QPixmap.fromImage(QImage(rgba, width, height, QImage.Format_RGBA8888))
+        self.rescale()
+        self.show()
+
+    def rescale(self):
+        if self.frame is not None:
+            self.setPixmap(self.frame.scaled(self.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+
+    def resizeEvent(self, event):
+        self.rescale()
+        super().resizeEvent(event)
+
+def print_error_to_terminal(e):
+    print("An Error occured:")
+    print(type(e))
+    traceback.print_tb(e.__traceback__)
+    print(e)
 
 class PlateTrackerApp(QMainWindow):
     def __init__(self):
@@ -41,7 +118,11 @@ class PlateTrackerApp(QMainWindow):
         icon_light.setPixmap(pm_icon_light.pixmap(25, 25))
         self.status_bar.addPermanentWidget(icon_light)
         self.progress_bar = QProgressBar()
-        self.progress_bar.setMaximum(5)
+        self.stats_label = QLabel()
+        self.worker = None
+        self.worker_thread = None
+        self.frame_view = None
+        self.frame_text = ""
 
 
         # Geographic file input
@@ -138,9 +219,15 @@ class PlateTrackerApp(QMainWindow):
         self.stop_button = QPushButton("Stop Animation")
         self.stop_button.setEnabled(False)
         self.stop_button.clicked.connect(self.handle_stop)
+        self.show_timings_checkbox = QCheckBox("Show Timings")
+        self.show_timings_checkbox.toggled.connect(self.toggle_stats_label)
+        self.resume_checkbox = QCheckBox("Resume Last Run")
+        self.resume_checkbox.setToolTip("Skip the frames an earlier run of the same animation finished")
         exec_layout = QHBoxLayout()
         exec_layout.addWidget(self.run_button)
         exec_layout.addWidget(self.stop_button)
+        exec_layout.addWidget(self.show_timings_checkbox)
+        exec_layout.addWidget(self.resume_checkbox)
 
         # Add widgets to layout
         self.layout.addLayout(rotation_layout)
@@ -184,13 +271,20 @@ class PlateTrackerApp(QMainWindow):
             self.rotation_file_entry.setText(file)
 
     def handle_stop(self):
-        self.should_stop = True
+        # the worker checks this between chunks and winds down on its own
+        if self.worker is not None:
+            self.worker.job.stop()
+        self.stop_button.setEnabled(False)
+
+    def finish_run(self, halted=False):
         self.stop_button.setEnabled(False)
         self.run_button.setEnabled(True)
         self.status_bar.removeWidget(self.progress_bar)
-        
-        # Close any active matplotlib figures
-        plt.close('all')
+        self.status_bar.clearMessage()
+        if halted and "matplotlib.pyplot" in sys.modules:
+            # Close any active matplotlib figures
+            import matplotlib.pyplot as plt
+            plt.close('all')
     
     def clear_layout(self, layout):
         """Recursively clear all widgets and layouts from the given layout."""
@@ -217,17 +311,7 @@ class PlateTrackerApp(QMainWindow):
             projection_layout = QHBoxLayout()
             projection_label = QLabel("Map Projection:")
             self.projection_combo = QComboBox()
-            self.projection_combo.addItems([
-                "Rectilinear",
-                "Orthographic",
-                "Robinson",
-                "Mollweide",
-                "Mercator",
-                "Transverse Mercator",
-                "Miller",
-                "Azimuthal Equidistant",
-                "Stereographic"
-            ])
+            self.projection_combo.addItems(PROJECTIONS)
             self.projection_combo.setMaximumWidth(200)
             projection_layout.addWidget(projection_label)
             projection_layout.addWidget(self.projection_combo)
@@ -260,9 +344,6 @@ class PlateTrackerApp(QMainWindow):
             self.output_inputs_layout.addLayout(latlon_layout)
             self.output_inputs_layout.addLayout(self.additional_inputs_layout)
 
-            self.save_fig = {"plot": False, "save": False, "anim": False}
-            if 0 in output_options:
-                self.save_fig["plot"] = True
             if 1 in output_options:
                 pdf_file_label = QLabel("Output .pdf file name:")
                 self.pdf_file_entry = QLineEdit()
@@ -273,7 +354,6 @@ class PlateTrackerApp(QMainWindow):
                 pdf_layout.addWidget(self.pdf_file_entry)
                 self.output_inputs_layout.addLayout(pdf_layout)
             if 2 in output_options:
-                self.save_fig["anim"] = True
                 mp4_file_label = QLabel("Output .mp4 file name:")
                 self.mp4_file_entry = QLineEdit()
                 self.mp4_file_entry.setText("output.mp4")
@@ -403,14 +483,11 @@ class PlateTrackerApp(QMainWindow):
 
     def run(self):
         try:
-            self.should_stop = False
             self.stop_button.setEnabled(True)
             self.run_button.setEnabled(False)
             self.status_bar.addWidget(self.progress_bar)
             self.progress_bar.setValue(0)
             self.progress_bar.show()
-            self.progress_bar.repaint()
-            QApplication.processEvents()
 
             rotation_file = self.rotation_file_entry.text()
             geo_files = self.get_geo_files()
@@ -418,166 +495,123 @@ class PlateTrackerApp(QMainWindow):
                                               self.end_time_entry.text(), self.step_time_entry.text())
             fixed_plate = self.fixed_plate_entry.text()
             output_options = [self.outputs.id(button) for button in self.outputs.buttons() if button.isChecked()]
-            if not os.path.isdir("output"): os.mkdir("output")
             print("read in files", flush=True)
 
             # Validate inputs
             if not rotation_file or not geo_files or time_array is None:
                 QMessageBox.critical(self, "Error", "Please fill in all required fields.")
-                self.handle_stop()
+                self.finish_run(halted=True)
                 return
             if time_array is False:
                 QMessageBox.warning(self, "Bad Interval", "Please enter a time interval that divides evenly into the range")
-                self.handle_stop()
+                self.finish_run(halted=True)
                 return
             print("validate fields", flush=True)
-            self.progress_bar.setValue(1)
-            self.progress_bar.repaint()
-            QApplication.processEvents() 
 
+            # figures are created on the main thread, the worker only draws into them
             figure = self.set_up_map(output_options)
-            self.progress_bar.setValue(2)
-            self.progress_bar.repaint()
-            QApplication.processEvents()
-            
-            # Set output path
-            output_folder = "output/"
-            if getattr(sys, 'frozen', False):
-                exec_dir = os.path.dirname(sys.executable)
-                output_folder = exec_dir + "/" + output_folder
-                print(output_folder)
-            
-            # generate each figure
-            for time in time_array:
-                self.progress_bar.setValue(3)
-                self.progress_bar.repaint()
-                QApplication.processEvents()
-                if self.should_stop:
-                    raise UserInterrupt("Execution stopped by user")
-
-                # solve plate rotations
-                engine = RotationEngine()
-                engine.rotfnd(rotation_file, time)
-                if fixed_plate:
-                    engine.hold_fixed_option(int(fixed_plate))
-                print("solve rotations")
-
-                # Read in plate by plate
-                plate_generator = file_handling.read_files(geo_files, time)
-                print("read in plates")
-            
-                # Rotate each plate
-                processed_plate_generator = engine.process_chunks(plate_generator)
-                print("process plates")
-
-                # Handle output
-                if 3 in output_options:    # Save DAT
-                    try:
-                        dat_name = output_folder + self.dat_file_entry.text()
-                        dat_file = saveDAT(dat_name)
-                        processed_plate_generator = dat_file.save_to_dat(processed_plate_generator, time)
-                        print("save to dat")
-                        QMessageBox.about(self, "Success", f"DAT output saved to {os.path.basename(dat_name)}")
-                    except Exception as e:
-                        QMessageBox.warning(self, "An Error occurred:", str(e))
-                        self.print_error_to_terminal(e)
-                
-                if 4 in output_options:    # Save KML
-                    try:
-                        kml_name = output_folder + self.kml_file_entry.text()
-                        kml_file = saveKML(kml_name)
-                        processed_plate_generator = kml_file.save_to_kml(processed_plate_generator)
-                        print("save to kml")
-                        QMessageBox.about(self, "Success", f"KML output saved to {os.path.basename(kml_name)}")
-                    except Exception as e:
-                        QMessageBox.warning(self, "An Error occurred:", str(e))
-                        self.print_error_to_terminal(e)
-
-                if 0 in output_options or 1 in output_options or 2 in output_options:  # Plot to Screen
-                    # different file name
-                    if 1 in output_options:
-                        pdf_file = output_folder + self.pdf_file_entry.text()
-                        if pdf_file[-4:] == ".pdf": pdf_file = pdf_file[:-4]    # remove file extension, if any
-                        if len(time_array) > 1:
-                            self.save_fig["save"] = pdf_file + "_" + str(time)
-                        else:
-                            self.save_fig["save"] = pdf_file
-
-                    try:
-                        figure.update_plot_vars(self.save_fig, time)
-                        processed_plate_generator = figure.plot_to_screen(processed_plate_generator)
-                        print("plot to screen")
-                        if 1 in output_options and len(time_array) == 1:
-                            QMessageBox.about(self, "Success", f"PDF output saved to {os.path.basename(pdf_file)}")
-                    except Exception as e:
-                        QMessageBox.warning(self, "An Error occurred:", str(e))
-                        self.print_error_to_terminal(e)
-
-                # ensures previous generator functions run through
-                for chunk in processed_plate_generator:
-                    pass
-
-                QApplication.processEvents()
-                self.progress_bar.setValue(4)
-                self.progress_bar.repaint()
-                QApplication.processEvents()
-
-            # if making animation, assemble now
-            if 2 in output_options:
-                try:
-                    mp4_file = output_folder + self.mp4_file_entry.text()
-                    if mp4_file[-4:] != ".mp4": mp4_file = mp4_file + ".mp4"    # add mp4 extension
-                    fps = self.fps_entry.text() if self.fps_entry.text() else 6
-                    figure.make_animation(mp4_file, fps)
-                    QMessageBox.about(self, "Success", f"MP4 output saved to {os.path.basename(mp4_file)}")
-                except Exception as e:
-                    QMessageBox.warning(self, "An Error occurred:", str(e))
-                    self.print_error_to_terminal(e)
-
-            self.progress_bar.setValue(5)
-            self.progress_bar.repaint()
-            QApplication.processEvents()
-            self.stop_button.setEnabled(False)
-            self.run_button.setEnabled(True)
-            self.status_bar.removeWidget(self.progress_bar)
+            if figure is None and (0 in output_options or 1 in output_options or 2 in output_options):
+                self.finish_run(halted=True)
+                return
+
+            file_names = {}
+            if 1 in output_options: file_names["pdf"] = self.pdf_file_entry.text()
+            if 2 in output_options: file_names["mp4"] = self.mp4_file_entry.text()
+            if 3 in output_options: file_names["dat"] = self.dat_file_entry.text()
+            if 4 in output_options: file_names["kml"] = self.kml_file_entry.text()
+            fps = self.fps_entry.text() if 2 in output_options and self.fps_entry.text() else 6
+
+            job = PlateTrackerJob(rotation_file, geo_files, time_array, output_options, file_names,
+                                  figure=figure, fixed_plate=fixed_plate, output_folder=get_output_folder(),
+                                  fps=fps, plot=0 in output_options, resume=self.resume_checkbox.isChecked())
+            self.start_worker(job)
 
-        except UserInterrupt:
-            QMessageBox.about(self, "Animation Halted", "Animation successfully halted")
-            print("User halted program")
-        except EOFError as rot_error:
-            QMessageBox.warning(self, "An Error occurred:", str(rot_error))
-            self.print_error_to_terminal(rot_error)
-        except ValueError as err:
-            QMessageBox.warning(self, "An Error occurred:", str(err))
-            self.print_error_to_terminal(err)
         except Exception as err:
             QMessageBox.warning(self, "An Error occurred:", 
                                 "A bug has been found or there is an error in an input file. " \
                                 "Please change parameters and try again.")
-            self.print_error_to_terminal(err)
+            print_error_to_terminal(err)
+            self.finish_run(halted=True)
+
+    def start_worker(self, job):
+        self.progress_bar.setMaximum(len(job.time_array))
+        self.worker_thread = QThread()
+        self.worker = PipelineWorker(job)
+        self.worker.moveToThread(self.worker_thread)
+
+        self.worker.frame_started.connect(self.show_frame_progress)
+        self.worker.chunk_processed.connect(self.show_chunk_progress)
+        self.worker.frame_ready.connect(self.draw_frame)
+        self.worker.succeeded.connect(self.show_success)
+        self.worker.failed.connect(self.show_failure)
+        self.worker.halted.connect(self.show_halted)
+        self.worker.stats_updated.connect(self.show_stats)
+
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.worker_finished)
+        self.worker_thread.start()
+
+    def show_frame_progress(self, frame, num_frames, time):
+        self.progress_bar.setValue(frame)
+        self.frame_text = f"{time}Ma ({frame + 1}/{num_frames})"
+        self.status_bar.showMessage(self.frame_text)
+
+    def show_chunk_progress(self, chunk_count):
+        self.status_bar.showMessage(f"{self.frame_text}: {chunk_count} chunks")
+
+    def show_stats(self, summary):
+        self.stats_label.setText(summary)
+        self.stats_label.setToolTip(f"Timings and counts for this run, full report in {get_output_folder()}")
+
+    def toggle_stats_label(self, checked):
+        # live timing summary from the run's instrumentation, left of the icon
+        if checked:
+            self.status_bar.insertPermanentWidget(0, self.stats_label)
+            self.stats_label.show()
+        else:
+            self.status_bar.removeWidget(self.stats_label)
+
+    def show_success(self, text):
+        QMessageBox.about(self, "Success", text)
+
+    def show_failure(self, title, text):
+        QMessageBox.warning(self, title, text)
+
+    def show_halted(self):
+        QMessageBox.about(self, "Animation Halted", "Animation successfully halted")
+
+    def draw_frame(self, rgba, width, height):
+        if self.frame_view is None:
+            self.frame_view = FrameView()
+        self.frame_view.show_image(rgba, width, height)
+
+    def closeEvent(self, event):
+        # a running job is stopped and its thread finished before the window goes
+        if self.worker_thread is not None:
+            self.worker.job.stop()
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+        if self.frame_view is not None:
+            self.frame_view.close()
+        event.accept()
+
+    def worker_finished(self):
+        # the thread has quit by now, so both objects can be released
+        job = self.worker.job
+        self.progress_bar.setValue(self.progress_bar.maximum())
+        self.worker.deleteLater()
+        self.worker_thread.deleteLater()
+        self.worker = None
+        self.worker_thread = None
+        self.finish_run(halted=job.should_stop)
 
     def get_time_bounds(self, start_text, end_text, step_text):
-        if not start_text: return None
-        if not end_text: return [float(start_text)]
-        start = float(start_text)
-        end = float(end_text)
-        if not step_text: 
-            step = (end - start) / 10.0
-        else:
-            step = float(step_text)
-        if step == 0:
-            QMessageBox.warning(self, "Invalid Step", "Interval cannot be 0")
+        try:
+            return get_time_array(start_text, end_text, step_text)
+        except ValueError as err:
+            QMessageBox.warning(self, "Invalid Step", str(err))
             return False
-        if (end - start) % step != 0.0: return False
-        
-        print(f"start: {start} end: {end} step: {step}")
-        if start < end:
-            time_array = np.linspace(start, end, int((end - start) / step) + 1)
-        else:
-            reversed_time_array = np.linspace(end, start, int((start - end) / step) + 1)
-            time_array = np.flip(reversed_time_array)
-
-        return time_array
     
     def set_up_map(self, output_options):
         # Set up map, if needed
@@ -621,15 +655,9 @@ class PlateTrackerApp(QMainWindow):
                 proj_kwargs["min_lat"] = int(self.min_lat_entry.text())
                 print("collect hemisphere")
 
-            figure = Figure(projection_option, **proj_kwargs)
+            from draw_map_gui import Figure     # loads cartopy and pyplot on first run
+            figure = Figure(projection_option, offscreen=True, **proj_kwargs)
             print("initialize figure")
             return figure
         
         return None
-
-    def print_error_to_terminal(self, e):
-        print("An Error occured:")
-        print(type(e))
-        traceback.print_tb(e.__traceback__)
-        print(e)
-        self.handle_stop()
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Timers and counters for a PaleoMapper run.
+
+The pipeline stages are chained generators, so one chunk passes through every
+stage before the next is read. Timers therefore nest, and each timer records its
+exclusive time: the time spent inside it minus the time spent in timers opened
+inside it. Wrapping each stage's generator with timed() charges every stage only
+for its own work.
+
+The active Instrumentation is module level, like the symbol library, so the
+engine and the figure can report without it being passed around:
+
+    with instrumentation.timer("savefig"):
+        ...
+    instrumentation.count("vertices", len(records))
+"""
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class Instrumentation:
+
+    def __init__(self):
+        self.timers = {}        # k: name; v: [exclusive seconds, calls]
+        self.counters = {}      # k: name; v: count
+        self.items = {}         # k: name; v: set of distinct values (e.g. missing plate ids)
+        self.frames = []        # one entry per finished frame
+        self.stack = []         # open timers as [name, seconds spent in nested timers]
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def timer(self, name):
+        entry = [name, 0.0]
+        self.stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            totals = self.timers.setdefault(name, [0.0, 0])
+            totals[0] += elapsed - entry[1]
+            totals[1] += 1
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+    def timed(self, name, generator):
+        """Passes items through, timing each step of generator under name."""
+        iterator = iter(generator)
+        while True:
+            with self.timer(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add(self, name, item):
+        self.items.setdefault(name, set()).add(item)
+
+    def merge(self, report):
+        """Adds the timers, counters and items of another run's report(), e.g. from a worker process."""
+        for name, timed in report["timers"].items():
+            totals = self.timers.setdefault(name, [0.0, 0])
+            totals[0] += timed["seconds"]
+            totals[1] += timed["calls"]
+        for name, amount in report["counters"].items():
+            self.count(name, amount)
+        for name, values in report["items"].items():
+            self.items.setdefault(name, set()).update(values)
+
+    def end_frame(self, plot_time, seconds, chunks):
+        self.frames.append({"time": float(plot_time), "seconds": seconds, "chunks": chunks})
+
+    def report(self):
+        return { "total_seconds": time.perf_counter() - self.start_time,
+                 "timers": { name: {"seconds": seconds, "calls": calls}
+                             for name, (seconds, calls) in sorted(self.timers.items(), key=lambda t: -t[1][0]) },
+                 "counters": dict(self.counters),
+                 "items": { name: sorted(values) for name, values in self.items.items() },
+                 "frames": self.frames }
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self, num_timers=4):
+        """One line for the status bar: the slowest stages and the chunk and vertex counts."""
+        slowest = sorted(self.timers.items(), key=lambda t: -t[1][0])[:num_timers]
+        parts = [ f"{name} {seconds:.2f}s" for name, (seconds, _) in slowest ]
+        parts.append(f"{self.counters.get('chunks', 0):,} chunks")
+        parts.append(f"{self.counters.get('vertices', 0):,} vertices")
+        missing = len(self.items.get("plates missing from model", ()))
+        if missing:
+            parts.append(f"{missing} missing plates")
+        if self.counters.get("polygon fallbacks"):
+            parts.append(f"{self.counters['polygon fallbacks']} polygon fallbacks")
+        return " | ".join(parts)
+
+class FrameProfiler:
+    """
+    Opt-in profiling of every frame: runs the frame under cProfile and tracemalloc,
+    saves frame_<n>_<time>Ma.prof to folder and records the frame's peak memory
+    with its largest chunk (most records) and slowest chunk (from being read to
+    being handed on by the last output stage). The summary of all frames is kept
+    in profile_summary.json, rewritten after each frame.
+
+    Open a frame's profile with: python -m pstats output/profile/frame_0003_30.0Ma.prof
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(folder): os.makedirs(folder)
+        self.frames = []
+        self.largest_chunk = None
+        self.slowest_chunk = None
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def chunk_done(self, chunk, seconds):
+        """Called with each chunk once it has been through every stage."""
+        records = len(chunk.records)
+        if self.largest_chunk is None or records > self.largest_chunk["records"]:
+            self.largest_chunk = self.describe(chunk, seconds)
+        if self.slowest_chunk is None or seconds > self.slowest_chunk["seconds"]:
+            self.slowest_chunk = self.describe(chunk, seconds)
+
+    def describe(self, chunk, seconds):
+        return { "plateid": chunk.plateid, "records": len(chunk.records), "seconds": seconds,
+                 "data_type": chunk.data_type, "label": chunk.label, "record_number": chunk.record_number }
+
+    def run_frame(self, frame, plot_time, function, *args):
+        """Runs function(*args) as frame number frame, for reconstruction time plot_time."""
+        self.largest_chunk = None
+        self.slowest_chunk = None
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            end_memory, peak_memory = tracemalloc.get_traced_memory()
+            prof_file = os.path.join(self.folder, f"frame_{frame:04d}_{float(plot_time)}Ma.prof")
+            profiler.dump_stats(prof_file)
+
+            self.frames.append({ "frame": frame,
+                                 "time": float(plot_time),
+                                 "seconds": seconds,
+                                 "peak_memory_mb": peak_memory / 1e6,
+                                 "frame_memory_mb": (peak_memory - start_memory) / 1e6,
+                                 "retained_memory_mb": (end_memory - start_memory) / 1e6,
+                                 "largest_chunk": self.largest_chunk,
+                                 "slowest_chunk": self.slowest_chunk,
+                                 "profile": os.path.basename(prof_file) })
+            slowest = self.slowest_chunk or {}
+            print(f"profile frame {frame} ({float(plot_time)}Ma): {seconds:.2f}s, peak {peak_memory / 1e6:.1f}MB, "
+                  f"slowest chunk plate {slowest.get('plateid')} ({slowest.get('records')} records, "
+                  f"{slowest.get('seconds', 0.0):.3f}s)")
+            self.save()
+
+    def save(self):
+        with open(os.path.join(self.folder, "profile_summary.json"), "w") as f:
+            json.dump(self.frames, f, indent=2)
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+        self.save()
+
+active = Instrumentation()
+
+def start_run():
+    """Starts a fresh set of timers and counters and returns it."""
+    global active
+    active = Instrumentation()
+    return active
+
+def timer(name):
+    return active.timer(name)
+
+def timed(name, generator):
+    return active.timed(name, generator)
+
+def count(name, amount=1):
+    active.count(name, amount)
+
+def add(name, item):
+    active.add(name, item)
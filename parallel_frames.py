@@ -0,0 +1,137 @@
+"""
+Renders the frames of an animation in worker processes.
+
+Every reconstruction time is independent until the frames are encoded, so each
+worker builds its own Figures and renders whole frames to raw RGBA, one image
+per figure. The frames
+come back in whatever order the workers finish them, and animation.FrameAssembler
+holds them in a reorder buffer until they can be piped to ffmpeg in time order.
+
+Used by PlateTrackerJob.run_frames when it is given more than one worker:
+
+python cli.py input/proj.json --rot default_input/Scotese_Plate_Model.rot \
+    --start 0 --end 200 --step 10 --outputs mp4 --workers 4
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import tempfile
+from time import perf_counter
+
+import instrumentation
+from animation import save_frame
+
+_job = None     # the worker process's PlateTrackerJob, set up by start_worker
+
+def start_worker(job_kwargs, figure_settings, scratch_dir):
+    global _job
+    import matplotlib
+    matplotlib.use("Agg")
+    from draw_map_gui import Figure
+    from pipeline import PlateTrackerJob
+
+    # rotfnd and sanitize_dat write scratch files to the working directory, so
+    # each worker gets its own, with the symbol library read_csv_in_chunks loads
+    work_dir = tempfile.mkdtemp(dir=scratch_dir)
+    if os.path.exists("shape_library.csv"):
+        shutil.copy("shape_library.csv", work_dir)
+    os.chdir(work_dir)
+
+    figures = [ Figure(proj_select, **figure_kwargs) for proj_select, figure_kwargs in figure_settings ]
+    _job = PlateTrackerJob(figure=figures, report_file="", **job_kwargs)
+    _job.errors = []
+    _job.on_error = _job.errors.append
+    _job.on_frame = lambda frame, num_frames, time: None
+
+def render_frame(frame, time, num_frames, output_options, frame_files):
+    """
+    Runs one frame in the worker and returns each figure's RGBA pixels with what
+    the parent reports. The images are also kept in frame_files, if given, for
+    run_manifest.
+    """
+    job = _job
+    job.output_options = output_options
+    job.stats = instrumentation.start_run()
+    job.stop_event.clear()
+    job.output_failed = False
+    job.errors.clear()
+    job.chunk_count = 0
+    saved = []
+
+    start = perf_counter()
+    try:
+        job.run_frame(time, num_frames, saved)
+    except Exception:
+        # output failures are already in job.errors, and stop the frame on its next chunk
+        if not job.errors:
+            raise
+    images = [ figure.frame_rgba() for figure in job.figures ]
+    for frame_file, (rgba, size) in zip(frame_files, images):
+        save_frame(frame_file, rgba, size)
+
+    return { "frame": frame,
+             "time": time,
+             "images": images,     # (RGBA bytes, size) of each figure
+             "seconds": perf_counter() - start,
+             "chunks": job.chunk_count,
+             "saved": saved,
+             "errors": [ f"{type(err).__name__}: {err}" for err in job.errors ],
+             "report": job.stats.report() }
+
+def render_frames(job, workers, frames, frame_files, window=2):
+    """
+    Renders frames, a list of (frame number, time), keeping each in the files listed
+    in frame_files[frame number], and yields each render_frame result as soon as a worker finishes it. No
+    more than window frames per worker are handed out past the earliest
+    unfinished one, which bounds how many frames wait in the reorder buffer.
+    Stopping the job cancels the frames not yet started, yields the ones being
+    rendered as they finish, then raises UserInterrupt, or OutputFailed if the
+    job stopped because an output failed.
+    """
+    num_frames = len(job.time_array)
+    frame_times = dict(frames)
+    geo_files = [ file[:2] + [os.path.abspath(file[2])] + file[3:] for file in job.geo_files ]
+    job_kwargs = { "rotation_file": os.path.abspath(job.rotation_file),
+                   "geo_files": geo_files,
+                   "time_array": job.time_array,
+                   "output_options": [],
+                   "file_names": job.file_names,
+                   "fixed_plate": job.fixed_plate,
+                   "output_folder": os.path.join(os.path.abspath(job.output_folder), ""),
+                   "fps": job.fps,
+                   "kml_tolerance": job.kml_tolerance }
+    # DAT and KML are rewritten every frame, so only the last frame writes them, as it would run serially
+    frame_outputs = [ option for option in job.output_options if option == 1 ]
+    last_outputs = [ option for option in job.output_options if option in (1, 3, 4) ]
+
+    with tempfile.TemporaryDirectory(prefix="paleomapper_") as scratch_dir:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"), initializer=start_worker,
+            initargs=(job_kwargs, [ (figure.proj, figure.kwargs) for figure in job.figures ], scratch_dir))
+        pending = {}    # k: future; v: frame number
+        queue = [ frame for frame, time in frames ]
+        try:
+            while queue or pending:
+                if job.should_stop:
+                    # frames already being drawn are finished and handed on, the rest are dropped
+                    queue.clear()
+                    for future in [ future for future in pending if future.cancel() ]:
+                        del pending[future]
+                earliest = min(pending.values(), default=queue[0] if queue else 0)
+                while queue and queue[0] < earliest + window * workers:
+                    frame = queue.pop(0)
+                    outputs = last_outputs if frame == num_frames - 1 else frame_outputs
+                    # workers run in their own directories, so they are given absolute paths
+                    files = [ os.path.abspath(frame_file) for frame_file in frame_files[frame] ]
+                    future = executor.submit(render_frame, frame, frame_times[frame], num_frames, outputs, files)
+                    pending[future] = frame
+
+                # wake up now and then to check for a stop request
+                done, _ = concurrent.futures.wait(pending, timeout=0.25, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in sorted(done, key=pending.get):
+                    del pending[future]
+                    yield future.result()
+            job.check_stop()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,465 @@
+import os
+import sys
+import threading
+from time import perf_counter
+import numpy as np
+
+import file_handling
+import instrumentation
+from animation import FrameAssembler, save_frame
+from create_dat import saveDAT
+from run_manifest import RunManifest, hash_inputs
+from simplify import LevelOfDetail
+from rotation_engine_class import RotationEngine
+
+# index matches Figure's proj_select
+PROJECTIONS = [ "Rectilinear",
+                "Orthographic",
+                "Robinson",
+                "Mollweide",
+                "Mercator",
+                "Transverse Mercator",
+                "Miller",
+                "Azimuthal Equidistant",
+                "Stereographic" ]
+
+# output option ids, as used by the GUI checkboxes
+OUTPUTS = { "plot": 0, "pdf": 1, "mp4": 2, "dat": 3, "kml": 4 }
+
+class UserInterrupt(Exception):
+    pass
+
+class OutputFailed(Exception):
+    """Ends a run after an output failed. The failure itself was already reported through on_error."""
+    pass
+
+class PlateTrackerJob:
+    """
+    One PaleoMapper run: for every reconstruction time, solve the plate rotations,
+    read and rotate the checked files chunk by chunk and hand the rotated chunks to
+    each requested output. Holds no Qt state, so it can be driven from a worker
+    thread by the GUI or directly from the command line.
+
+    Output options use the GUI's checkbox ids:
+    0 plot to screen, 1 pdf, 2 animation (mp4), 3 dat, 4 kml
+
+    figure can also be a list of Figures, to draw each reconstruction in several
+    projections at once: rotations are solved and the files read and rotated
+    once per time, and every figure draws the same rotated chunks. Each figure
+    gets its own PDFs and mp4, named after its projection.
+    """
+
+    def __init__(self, rotation_file, geo_files, time_array, output_options, file_names,
+                 figure=None, fixed_plate="", output_folder="output/", fps=6, plot=False,
+                 report_file="run_report.json", profile=False, workers=1, resume=False,
+                 kml_tolerance=0.0, single_pdf=False, keep_frames=False):
+        self.rotation_file = rotation_file
+        self.geo_files = geo_files
+        self.time_array = list(time_array)
+        self.output_options = output_options
+        self.file_names = file_names    # k: "pdf", "mp4", "dat" or "kml"; v: file name
+        self.figures = list(figure) if isinstance(figure, (list, tuple)) else [ figure ] if figure is not None else []
+        self.figure = self.figures[0] if self.figures else None     # the one shown on screen
+        self.fixed_plate = fixed_plate
+        self.output_folder = output_folder
+        self.fps = fps
+        self.report_file = report_file  # timing and counter report, saved in the output folder
+        self.profile = profile          # cProfile and tracemalloc every frame into output_folder/profile/
+        self.profiler = None
+        self.workers = workers          # processes rendering animation frames at once (see parallel_frames)
+        self.resume = resume            # skip the frames a previous run of the same job finished (see run_manifest)
+        self.keep_frames = keep_frames  # keep animation frames as PNGs, so a resumed run can reuse them for the mp4
+        self.manifest = None
+        self.kml_tolerance = kml_tolerance  # degrees a KML line may be simplified by, 0 for every point
+        self.single_pdf = single_pdf    # every frame as a page of one PDF, rather than a PDF per frame
+        self.pdf_pages = []             # with single_pdf, the open PdfPages of each figure
+        self.level_of_detail = LevelOfDetail()  # kept for the whole run, features are simplified once
+        self.frame_failed = False       # an output of the current frame failed, so it is left out of the manifest
+        self.output_failed = False      # the run is stopping because an output failed, not because it was halted
+        self.save_fig = {"plot": plot, "save": False, "anim": 2 in output_options}
+
+        self.stop_event = threading.Event()
+        self.chunk_count = 0
+        self.stats = instrumentation.active
+
+        # progress hooks, replaced by whoever drives the job
+        self.on_frame = lambda frame, num_frames, time: print(f"frame {frame + 1}/{num_frames}: {time}Ma")
+        self.on_chunk = lambda chunk_count: None
+        self.on_success = lambda text: print(text)
+        self.on_error = lambda err: print(f"An Error occurred: {err}")
+        self.on_stats = lambda summary: None
+
+    @property
+    def should_stop(self):
+        return self.stop_event.is_set()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def check_stop(self):
+        if self.should_stop:
+            if self.output_failed:
+                raise OutputFailed("Execution stopped after an output failed")
+            raise UserInterrupt("Execution stopped by user")
+
+    def wait(self, seconds):
+        """Sleep between frames, waking up immediately if the job is stopped."""
+        self.stop_event.wait(seconds)
+        self.check_stop()
+
+    def checkpoint(self, chunk_generator, count=False):
+        """
+        Pass chunks through unchanged, checking for cancellation before each one
+        and, if count is set, reporting progress. Placed between pipeline stages so
+        that a stop request takes effect inside the rotation and rendering loops.
+        """
+        chunk_start = perf_counter()
+        for chunk in chunk_generator:
+            self.check_stop()
+            if count:
+                self.chunk_count += 1
+                self.on_chunk(self.chunk_count)
+            yield chunk
+            if count and self.profiler:
+                # resumed once the downstream stages are done with this chunk
+                self.profiler.chunk_done(chunk, perf_counter() - chunk_start)
+                chunk_start = perf_counter()
+
+    def output_path(self, key):
+        return self.output_folder + self.file_names[key]
+
+    def figure_suffix(self, index):
+        """Added to the names of figure index's files when there are several figures, e.g. "_Mollweide"."""
+        if len(self.figures) < 2:
+            return ""
+        names = [ PROJECTIONS[figure.proj].replace(" ", "") for figure in self.figures ]
+        name = names[index]
+        if names.count(name) > 1:
+            name += str(names[:index + 1].count(name))  # the same projection twice, with different settings
+        return "_" + name
+
+    def handle_output_error(self, err):
+        self.frame_failed = True
+        self.output_failed = True
+        self.on_error(err)
+        self.stop()
+
+    def run(self):
+        if not os.path.isdir(self.output_folder): os.makedirs(self.output_folder)
+        self.stats = instrumentation.start_run()
+        if self.profile:
+            self.profiler = instrumentation.FrameProfiler(self.output_folder + "profile")
+        # only series are worth resuming, and only resumed if asked to
+        if not self.save_fig["plot"] and len(self.time_array) > 1:
+            self.manifest = RunManifest(self.output_folder, hash_inputs(self), resume=self.resume)
+        try:
+            self.run_frames()
+        finally:
+            if self.profiler:
+                self.profiler.stop()
+                self.profiler = None
+            self.manifest = None
+            if self.report_file:
+                self.stats.save(self.output_folder + self.report_file)
+            self.on_stats(self.stats.summary())
+
+    def run_frames(self):
+        num_frames = len(self.time_array)
+        saved = []
+
+        frames = list(enumerate(self.time_array))
+        if self.manifest:
+            frames = [ (frame, time) for frame, time in frames if not self.manifest.done(time) ]
+            if not frames:
+                self.on_success(f"All {num_frames} frames were finished by an earlier run, nothing was drawn. "
+                                "Run again without resuming to draw them again.")
+            elif len(frames) < num_frames:
+                print(f"{num_frames - len(frames)} of {num_frames} frames were finished by an earlier run, skipping them")
+
+        # every frame goes into the same PDF, so one left out by an earlier run would be missing from it
+        paging = self.single_pdf and 1 in self.output_options and self.figures
+        if paging and frames and len(frames) < num_frames:
+            print("Every frame is drawn again for the PDF of the whole series")
+            frames = list(enumerate(self.time_array))
+
+        # the same goes for the mp4 when the earlier run didn't keep its frames, or deleted them once it finished
+        animating = 2 in self.output_options and self.figure is not None
+        if animating and frames and len(frames) < num_frames:
+            rendering = set(frame for frame, time in frames)
+            if any(not self.manifest.done(time)["frame_files"] for frame, time in enumerate(self.time_array)
+                   if frame not in rendering):
+                print("Every frame is drawn again for the mp4, the earlier run's frames weren't kept")
+                frames = list(enumerate(self.time_array))
+
+        # frames are piped to ffmpeg in time order as they are drawn, or as the
+        # worker processes finish them when rendering in parallel
+        assemblers = []     # one per figure
+        if animating:
+            mp4_file = self.output_path("mp4")
+            if mp4_file[-4:] == ".mp4": mp4_file = mp4_file[:-4]    # the suffix goes before the extension
+            for index, figure in enumerate(self.figures):
+                assemblers.append(FrameAssembler(mp4_file + self.figure_suffix(index) + ".mp4", self.fps, figure.ffmpeg_path()))
+            rendering = set(frame for frame, time in frames)
+            for frame, time in enumerate(self.time_array):
+                if frame not in rendering:
+                    for assembler, frame_file in zip(assemblers, self.manifest.done(time)["frame_files"]):
+                        assembler.add_cached_frame(frame, frame_file)
+
+        if paging and frames:
+            from matplotlib.backends.backend_pdf import PdfPages
+            self.pdf_pages = [ PdfPages(self.series_pdf_name(index)) for index in range(len(self.figures)) ]
+        try:
+            if animating and self.use_workers():
+                self.run_frames_parallel(frames, assemblers, saved)
+            else:
+                for frame, time in frames:
+                    self.check_stop()
+                    self.on_frame(frame, num_frames, time)
+                    self.chunk_count = 0
+                    self.frame_failed = False
+                    frame_start = perf_counter()
+
+                    if self.profiler:
+                        self.profiler.run_frame(frame, time, self.run_frame, time, num_frames, saved)
+                    else:
+                        self.run_frame(time, num_frames, saved)
+                    self.stats.end_frame(time, perf_counter() - frame_start, self.chunk_count)
+                    self.on_stats(self.stats.summary())
+
+                    frame_files = []
+                    if animating:
+                        try:
+                            for index, (figure, assembler) in enumerate(zip(self.figures, assemblers)):
+                                rgba, size = figure.frame_rgba()
+                                if self.manifest and self.keep_frames:
+                                    frame_files.append(self.manifest.frame_file(time, self.figure_suffix(index)))
+                                    save_frame(frame_files[-1], rgba, size)
+                                assembler.add_frame(frame, rgba, size)
+                        except Exception as e:
+                            self.handle_output_error(e)
+                    self.record_frame(frame, time, frame_files)
+
+                    if self.save_fig["plot"] and frame < num_frames - 1:
+                        self.wait(0.5)  # leave each animation frame on screen briefly
+        finally:
+            # closing the pipe writes the video, including the frames of a halted run
+            videos = []
+            for assembler in assemblers:
+                try:
+                    if assembler.finish():
+                        saved.append(("MP4", assembler.anim_name))
+                        videos.append(assembler.anim_name)
+                except Exception as e:
+                    self.handle_output_error(e)
+            # the fonts shared by all the pages are written as the PDF is closed
+            for index, pages in enumerate(self.pdf_pages):
+                try:
+                    with self.stats.timer("savefig"):
+                        page_count = pages.get_pagecount()
+                        pages.close()
+                    if page_count:
+                        saved.append(("PDF", self.series_pdf_name(index)))
+                except Exception as e:
+                    self.handle_output_error(e)
+            self.pdf_pages = []
+
+        # a finished animation no longer needs its frames kept for resuming
+        if (self.manifest and assemblers and len(videos) == len(assemblers) and not self.should_stop
+                and all(self.manifest.done(time) for time in self.time_array)):
+            self.manifest.release_frames(videos)
+
+        for file_type, file_name in dict.fromkeys(saved):
+            self.on_success(f"{file_type} output saved to {os.path.basename(file_name)}")
+
+    def record_frame(self, frame, time, frame_files):
+        """Adds a frame to the manifest once all its outputs are written, so a rerun can skip it."""
+        if self.manifest is None or self.frame_failed:
+            return
+        num_frames = len(self.time_array)
+        outputs = []
+        if 1 in self.output_options:
+            for index, figure in enumerate(self.figures):
+                pdf_name = self.pdf_name(time, num_frames, index)
+                pdf_file = self.series_pdf_name(index) if self.single_pdf else pdf_name + ".pdf"
+                outputs += [ pdf_file ] + figure.export_names(pdf_name)
+        if frame == num_frames - 1:
+            # DAT and KML are rewritten every frame and left holding the last
+            outputs += [ self.output_path(key) for key, option in (("dat", 3), ("kml", 4)) if option in self.output_options ]
+        self.manifest.record(time, outputs, frame_files)
+
+    def use_workers(self):
+        """
+        Animations render in worker processes if asked to, unless shown on screen,
+        profiled or paged into one PDF, which only this process can write to.
+        """
+        return self.workers > 1 and len(self.time_array) > 1 and not self.save_fig["plot"] and not self.profile \
+            and not (self.single_pdf and 1 in self.output_options)
+
+    def run_frames_parallel(self, frames, assemblers, saved):
+        """
+        Renders the frames in self.workers processes, reporting each one as it
+        finishes, and hands them to the assemblers to be written in time order.
+        """
+        from parallel_frames import render_frames
+        num_frames = len(self.time_array)
+        frame_files = {}    # k: frame number; v: where each figure's frame is kept, empty unless keeping frames
+        for frame, time in frames:
+            frame_files[frame] = [ self.manifest.frame_file(time, self.figure_suffix(index))
+                                   for index in range(len(self.figures)) ] if self.manifest and self.keep_frames else []
+        finished = num_frames - len(frames)
+        for result in render_frames(self, self.workers, frames, frame_files):
+            self.on_frame(finished, num_frames, result["time"])
+            finished += 1
+            self.frame_failed = False
+            for err in result["errors"]:
+                self.handle_output_error(RuntimeError(f"frame {result['frame']} ({result['time']}Ma): {err}"))
+            saved.extend(result["saved"])
+            self.stats.merge(result["report"])
+            self.stats.end_frame(result["time"], result["seconds"], result["chunks"])
+            self.on_stats(self.stats.summary())
+            try:
+                for assembler, (rgba, size) in zip(assemblers, result["images"]):
+                    assembler.add_frame(result["frame"], rgba, size)
+            except Exception as e:
+                self.handle_output_error(e)
+            self.record_frame(result["frame"], result["time"], frame_files[result["frame"]])
+
+    def pdf_name(self, time, num_frames, index=0):
+        """The PDF of figure index for time, without its extension."""
+        pdf_file = self.output_path("pdf")
+        if pdf_file[-4:] == ".pdf": pdf_file = pdf_file[:-4]    # remove file extension, if any
+        pdf_file += self.figure_suffix(index)
+        if num_frames > 1:
+            return pdf_file + "_" + str(time)
+        return pdf_file
+
+    def series_pdf_name(self, index=0):
+        """With single_pdf, the PDF holding every frame of figure index."""
+        return self.pdf_name(None, 1, index) + ".pdf"
+
+    def cull(self, chunk_generator, engine):
+        """
+        Leaves out the chunks a figure can't show: those whose bounding caps,
+        rotated with their plates, don't reach the map's view. Chunks no figure
+        can show are dropped before rotation unless the DAT or KML output needs
+        them; otherwise they are only marked for plot_to_screen to pass by.
+        """
+        views = [ (figure, figure.view_cap) for figure in self.figures if figure.view_cap is not None ]
+        whole_globe = len(views) < len(self.figures)    # some figure shows every chunk
+        drop = 3 not in self.output_options and 4 not in self.output_options and not whole_globe
+        rotations = {}  # k: plate id; v: rotation matrix
+        for chunk in chunk_generator:
+            if chunk.bounding_cap is not None:
+                center, radius = chunk.bounding_cap
+                plateid = int(chunk.plateid)
+                if plateid not in rotations:
+                    rotations[plateid] = engine.rotation_matrix(plateid)
+                center = rotations[plateid] @ center
+                chunk.hidden_from = tuple(figure for figure, view in views if not view.overlaps(center, radius))
+                if chunk.hidden_from:
+                    instrumentation.count("chunks culled", len(chunk.hidden_from))
+                    if drop and len(chunk.hidden_from) == len(self.figures):
+                        continue
+            yield chunk
+
+    def run_frame(self, time, num_frames, saved):
+        """Solves, reads, rotates and outputs one reconstruction time."""
+        timed = self.stats.timed
+
+        # solve plate rotations
+        with self.stats.timer("rotation solving"):
+            engine = RotationEngine()
+            engine.rotfnd(self.rotation_file, time)
+            if self.fixed_plate:
+                engine.hold_fixed_option(int(self.fixed_plate))
+        print("solve rotations")
+
+        # Read in plate by plate
+        plate_generator = timed("file reading", file_handling.read_files(self.geo_files, time))
+        if self.figures or (4 in self.output_options and self.kml_tolerance):
+            plate_generator = timed("simplification", self.level_of_detail.annotate(plate_generator))
+        if any(figure.view_cap is not None for figure in self.figures):
+            plate_generator = timed("culling", self.cull(plate_generator, engine))
+        plate_generator = self.checkpoint(plate_generator)
+        print("read in plates")
+
+        # Rotate each plate
+        processed_plate_generator = self.checkpoint(timed("chunk rotation", engine.process_chunks(plate_generator)), count=True)
+        print("process plates")
+
+        # Handle output
+        if 3 in self.output_options:    # Save DAT
+            try:
+                dat_file = saveDAT(self.output_path("dat"))
+                processed_plate_generator = timed("dat output", dat_file.save_to_dat(processed_plate_generator, time))
+                print("save to dat")
+                saved.append(("DAT", self.output_path("dat")))
+            except Exception as e:
+                self.handle_output_error(e)
+
+        if 4 in self.output_options:    # Save KML
+            try:
+                from create_kml import saveKML
+                kml_file = saveKML(self.output_path("kml"), np.radians(self.kml_tolerance))
+                processed_plate_generator = timed("kml output", kml_file.save_to_kml(processed_plate_generator))
+                print("save to kml")
+                saved.append(("KML", self.output_path("kml")))
+            except Exception as e:
+                self.handle_output_error(e)
+
+        # Plot to Screen, PDF or animation, every figure drawing the same rotated chunks as they pass
+        for index, figure in enumerate(self.figures):
+            # different file name
+            save_fig = dict(self.save_fig)
+            if 1 in self.output_options:
+                save_fig["save"] = self.pdf_name(time, num_frames, index)
+                save_fig["pages"] = self.pdf_pages[index] if self.pdf_pages else None
+                if num_frames == 1 and not self.pdf_pages:
+                    saved.append(("PDF", save_fig["save"]))
+                    saved += [ (name.rsplit(".", 1)[1].upper(), name) for name in figure.export_names(save_fig["save"]) ]
+
+            try:
+                figure.update_plot_vars(save_fig, time)
+                processed_plate_generator = timed("plotting", figure.plot_to_screen(processed_plate_generator))
+                print("plot to screen")
+            except Exception as e:
+                self.handle_output_error(e)
+
+        # ensures previous generator functions run through
+        for chunk in processed_plate_generator:
+            pass
+
+def get_time_array(start_text, end_text, step_text):
+    """
+    Returns the reconstruction times to plot, None if no start time is given, or
+    False if the interval does not divide evenly into the range. Raises ValueError
+    for a zero interval.
+    """
+    if not start_text: return None
+    if not end_text: return [float(start_text)]
+    start = float(start_text)
+    end = float(end_text)
+    if not step_text:
+        step = (end - start) / 10.0
+    else:
+        step = float(step_text)
+    if step == 0:
+        raise ValueError("Interval cannot be 0")
+    if (end - start) % step != 0.0: return False
+
+    print(f"start: {start} end: {end} step: {step}")
+    if start < end:
+        time_array = np.linspace(start, end, int((end - start) / step) + 1)
+    else:
+        reversed_time_array = np.linspace(end, start, int((start - end) / step) + 1)
+        time_array = np.flip(reversed_time_array)
+
+    return time_array
+
+def get_output_folder():
+    output_folder = "output/"
+    if getattr(sys, 'frozen', False):
+        exec_dir = os.path.dirname(sys.executable)
+        output_folder = exec_dir + "/" + output_folder
+        print(output_folder)
+    return output_folder
@@ -1,6 +1,7 @@
 import numpy as np
 import math
 
+import instrumentation
 from file_handling import Record
 
 class RotationEngine:
@@ -344,6 +345,23 @@ class RotationEngine:
                 anlong=anlong-360.0
         
         return anlat, anlong
+
+    def rotation_matrix(self, plateid):
+        """
+        The rotation rotate applies to plateid, as a matrix for unit vectors,
+        or the identity if the model doesn't have the plate.
+        """
+        index = self.plate_id_to_index.get(plateid)
+        if index is None:
+            return np.identity(3)
+        rotlat, rotlo, rotan = self.final_rotation_data[index][1:4]
+        d = self.d
+        gx = np.sin(90.0*d - rotlat*d) * np.cos(rotlo*d)
+        gy = np.sin(90.0*d - rotlat*d) * np.sin(rotlo*d)
+        gz = np.cos(90.0*d - rotlat*d)
+        g = np.array([gx, gy, gz])
+        cross = np.array([ [0.0, -gz, gy], [gz, 0.0, -gx], [-gy, gx, 0.0] ])
+        return np.cos(rotan*d) * np.identity(3) + (1.0 - np.cos(rotan*d)) * np.outer(g, g) + np.sin(rotan*d) * cross
     
     def process_chunks(self, chunk_generator):
 
@@ -356,10 +374,14 @@ class RotationEngine:
                 rotan = self.final_rotation_data[int_rot][3]
             else:
                 print(f"Plate id {plateid} not in rotation file. Assigning zero rotation")
+                instrumentation.add("plates missing from model", plateid)
+                instrumentation.count("chunks on missing plates")
                 rotlat = 0.0
                 rotlo = 0.0
                 rotan = 0.0
 
+            instrumentation.count("chunks")
+            instrumentation.count("vertices", len(chunk.records))
             # Modify records in the chunk
             modified_records = []
             for record in chunk.records:
@@ -0,0 +1,283 @@
+import numpy as np
+import os
+
+import instrumentation
+from file_handling import Record
+from rotation_engine_class import RotationEngine
+
+DEG_TO_RAD = 180.0 / np.pi   # same (misnamed) constant as the scalar engines: divide by it to get radians
+D = .017453292519943
+
+# parsed .rot files, k: (filename, mtime); v: list of (plateid, records array) blocks
+_model_cache = {}
+
+def adder_batch(pole1_lat, pole1_lon, angle1, pole2_lat, pole2_lon, angle2):
+    """
+    RotationEngine.adder over arrays: combines each rotation 1 with rotation 2 and
+    returns (pole_lat, pole_lon, angle) arrays. Keeps the scalar edge cases; values
+    the scalar version would raise a math domain error on are clipped instead.
+    """
+    pole1_lat, pole1_lon, angle1, pole2_lat, pole2_lon, angle2 = np.broadcast_arrays(
+        *[ np.asarray(value, dtype=float) for value in (pole1_lat, pole1_lon, angle1, pole2_lat, pole2_lon, angle2) ])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lat1_rad = pole1_lat / DEG_TO_RAD
+        lon1_rad = pole1_lon / DEG_TO_RAD
+        angle1_rad = angle1 / DEG_TO_RAD
+        lat2_rad = pole2_lat / DEG_TO_RAD
+        lon2_rad = pole2_lon / DEG_TO_RAD
+        angle2_rad = angle2 / DEG_TO_RAD
+
+        # Quaternion components for both rotations
+        q1_w = np.cos(angle1_rad / 2.0)
+        q1_x = np.sin(angle1_rad / 2.0) * np.sin(np.pi / 2.0 - lat1_rad) * np.cos(lon1_rad)
+        q1_y = np.sin(angle1_rad / 2.0) * np.sin(np.pi / 2.0 - lat1_rad) * np.sin(lon1_rad)
+        q1_z = np.sin(angle1_rad / 2.0) * np.cos(np.pi / 2.0 - lat1_rad)
+        q2_w = np.cos(angle2_rad / 2.0)
+        q2_x = np.sin(angle2_rad / 2.0) * np.sin(np.pi / 2.0 - lat2_rad) * np.cos(lon2_rad)
+        q2_y = np.sin(angle2_rad / 2.0) * np.sin(np.pi / 2.0 - lat2_rad) * np.sin(lon2_rad)
+        q2_z = np.sin(angle2_rad / 2.0) * np.cos(np.pi / 2.0 - lat2_rad)
+
+        # Hamilton product
+        combined_w = q1_w*q2_w - q1_x*q2_x - q1_y*q2_y - q1_z*q2_z
+        combined_x = q1_w*q2_x + q1_x*q2_w - q1_y*q2_z + q1_z*q2_y
+        combined_y = q1_w*q2_y + q1_x*q2_z + q1_y*q2_w - q1_z*q2_x
+        combined_z = q1_w*q2_z - q1_x*q2_y + q1_y*q2_x + q1_z*q2_w
+
+        # Back to Euler pole
+        total_angle = np.arccos(np.clip(combined_w, -1.0, 1.0)) * 2.0 * DEG_TO_RAD
+        zero_angle = total_angle == 0.0
+        total_angle = np.where(total_angle > 180.0, total_angle - 360.0, total_angle)
+
+        sin_half = np.sin(total_angle / (2 * DEG_TO_RAD))
+        pole_lat = 90.0 - np.arccos(np.clip(combined_z / sin_half, -1.0, 1.0)) * DEG_TO_RAD
+        pole_lat = np.where(total_angle < 0.0, -pole_lat, pole_lat)
+        pole_lon = np.arctan2(combined_y, combined_x) * DEG_TO_RAD
+        pole_lon = np.where(pole_lon > 180.0, pole_lon - 360.0, pole_lon)
+
+    # Edge cases, lowest priority first so the scalar check order wins
+    no_rotation = zero_angle | (sin_half == 0.0)
+    pole_lat = np.where(no_rotation, 90.0, pole_lat)
+    pole_lon = np.where(no_rotation, 0.0, pole_lon)
+    total_angle = np.where(no_rotation, 0.0, total_angle)
+
+    for mask, lat, lon, angle in [ (angle2 == 0.0, pole1_lat, pole1_lon, angle1),
+                                   (angle1 == 0.0, pole2_lat, pole2_lon, angle2),
+                                   (angle1 == -angle2, 90.0, 0.0, 0.0) ]:
+        pole_lat = np.where(mask, lat, pole_lat)
+        pole_lon = np.where(mask, lon, pole_lon)
+        total_angle = np.where(mask, angle, total_angle)
+
+    return pole_lat, pole_lon, total_angle
+
+def rotate_batch(alat, along, rotlat, rotlo, rotan):
+    """
+    RotationEngine.rotate for arrays of points about one pole. Returns (lat, lon)
+    arrays and uses the same approximate constants as the scalar version.
+    """
+    alat = np.asarray(alat, dtype=float)
+    along = np.asarray(along, dtype=float)
+    alat = np.where(alat == 90.0, 89.9, alat)     # handle the exceptions
+    alat = np.where(alat == -90.0, -89.9, alat)
+
+    if rotan == 0.0:
+        return alat, along
+
+    a1 = 90.0*D - alat*D
+    sina1 = np.sin(a1)
+    a2 = along*D
+    px = sina1*np.cos(a2)
+    py = sina1*np.sin(a2)
+    pz = np.cos(a1)
+    a3 = 90.0*D - rotlat*D
+    sina3 = np.sin(a3)
+    a4 = rotan*D
+    cosa4 = np.cos(a4)
+    sina4 = np.sin(a4)
+    a5 = rotlo*D
+    sina5 = np.sin(a5)
+    cosa5 = np.cos(a5)
+    gx = sina3*cosa5
+    gy = sina3*sina5
+    gz = np.cos(a3)
+    vct = (px*gx) + (py*gy) + (pz*gz)
+    rx = cosa4*px + (1.0-cosa4)*vct*gx + sina4*(gy*pz-gz*py)
+    ry = cosa4*py + (1.0-cosa4)*vct*gy + sina4*(gz*px-gx*pz)
+    rz = cosa4*pz + (1.0-cosa4)*vct*gz + sina4*(gx*py-gy*px)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        asin1 = np.arctan(rz / np.sqrt(np.clip(1.0 - (rz*rz), 0.0, None)))
+    acos1 = np.where(rz == 1.0, 0.0, ((3.14159/2.0) - asin1) * 57.29578)
+
+    anlat = 90.0 - acos1
+    anlong = 90.0 - (np.arctan2(rx, ry) * 57.29578)
+    anlong = np.where(anlong > 180.0, anlong - 360.0, anlong)
+    return anlat, anlong
+
+def read_rotation_model(rotation_filename):
+    """
+    Parses a .rot file into one array of [time, pole lat, pole lon, angle, ref plate]
+    rows, skipping 999 (comment) plates, with the plate id and block number of each
+    row. A block is a run of consecutive rows for the same plate. Cached until the
+    file changes.
+    """
+    key = (os.path.abspath(rotation_filename), os.path.getmtime(rotation_filename))
+    if key in _model_cache:
+        return _model_cache[key]
+
+    rows = []
+    plate_ids = []
+    with open(rotation_filename, "r") as rotation_file:
+        for line in rotation_file:
+            record = line.split()
+            if not record:
+                continue
+            plateid = int(record[0])
+            if plateid == 999:
+                continue
+            plate_ids.append(plateid)
+            rows.append((float(record[1]), float(record[2]), float(record[3]), float(record[4]), int(record[5])))
+
+    rows = np.array(rows, dtype=float).reshape(-1, 5)
+    plate_ids = np.array(plate_ids, dtype=np.int64)
+    block_ids = np.cumsum(np.r_[True, plate_ids[1:] != plate_ids[:-1]]) - 1 if len(plate_ids) else plate_ids
+
+    _model_cache.clear()    # only the model in use is worth keeping
+    _model_cache[key] = (rows, plate_ids, block_ids)
+    return _model_cache[key]
+
+class VectorRotationEngine(RotationEngine):
+    """
+    RotationEngine with batched rotation solving and chunk rotation. Fills the same
+    tables as the scalar engine (rotation_data, rotation_metadata, final_rotation_data,
+    plate_id_to_index, rot_list) so hold_fixed_option and the outputs work unchanged.
+    Checked against the scalar engines with verify_rotations.py; the pipeline keeps
+    the scalar engine until that passes on every bundled model.
+    """
+
+    def rotfnd(self, rotation_filename, target_time):
+        rows, row_plate_ids, block_ids = read_rotation_model(rotation_filename)
+
+        # --- PHASE 1: Time Interpolation ---
+        # first pair of rows in each plate block that brackets the target time and
+        # shares a reference frame, as the scalar reader finds it
+        valid = ((block_ids[1:] == block_ids[:-1]) & (target_time <= rows[1:, 0])
+                 & (rows[1:, 4] == rows[:-1, 4]))
+        pair_ends = np.flatnonzero(valid) + 1
+        _, first = np.unique(block_ids[pair_ends], return_index=True)
+        pair_ends = pair_ends[first]
+
+        # the scalar reader runs off the end of the file looking for the last plate
+        if not len(pair_ends) or block_ids[pair_ends[-1]] != block_ids[-1]:
+            print("Reached end of rotation file")
+            raise EOFError("Reached end of rotation file before " \
+                "finding all valid rotations: lower plot time or load new rotation file")
+        print("File processing complete, building reconstruction")
+
+        previous = rows[pair_ends - 1]
+        current = rows[pair_ends]
+        plate_ids = row_plate_ids[pair_ends].tolist()
+        time_span = current[:, 0] - previous[:, 0]
+        # a repeated time gives an inf or nan weight, as the scalar engine does for numpy times
+        with np.errstate(divide='ignore', invalid='ignore'):
+            time_weight = np.where(time_span == 0, 0.0, (current[:, 0] - target_time) / time_span)
+
+        interpolated_lat, interpolated_lon, interpolated_angle = adder_batch(
+            current[:, 1], current[:, 2], -current[:, 3], previous[:, 1], previous[:, 2], previous[:, 3])
+        interpolated_angle = interpolated_angle * time_weight
+        interpolated_lat, interpolated_lon, interpolated_angle = adder_batch(
+            current[:, 1], current[:, 2], current[:, 3], interpolated_lat, interpolated_lon, interpolated_angle)
+
+        # Store results from index 1, index 0 stays the zero rotation for plate 0
+        num_rotations = len(plate_ids) + 1
+        while num_rotations >= self.max_num_plates:
+            self.resize_arrays()
+        ref_frames = previous[:, 4].astype(int)
+        self.rotation_data[1:num_rotations, 1] = interpolated_lat
+        self.rotation_data[1:num_rotations, 2] = interpolated_lon
+        self.rotation_data[1:num_rotations, 3] = interpolated_angle
+        self.rotation_metadata[1:num_rotations, 1] = ref_frames
+        self.rotation_metadata[1:num_rotations, 2] = plate_ids
+        for index, plateid in enumerate(plate_ids, 1):
+            self.rotation_index_map[plateid] = index
+
+        # --- PHASE 2: Reference Frame Reduction ---
+        # walk every plate up its reference chain at once, one level per pass
+        total_lat = self.rotation_data[:num_rotations, 1].copy()
+        total_lon = self.rotation_data[:num_rotations, 2].copy()
+        total_angle = self.rotation_data[:num_rotations, 3].copy()
+        ref_frames = self.rotation_metadata[:num_rotations, 1].copy()
+        # rotation_index_map as sorted arrays, later rows win for repeated plates
+        map_ids = np.array(list(self.rotation_index_map.keys()), dtype=np.int64)
+        map_index = np.array(list(self.rotation_index_map.values()), dtype=np.int64)
+        order = np.argsort(map_ids)
+        map_ids = map_ids[order]
+        map_index = map_index[order]
+        for level in range(num_rotations):
+            pending = np.nonzero(ref_frames != 0)[0]
+            if not len(pending):
+                break
+            position = np.clip(np.searchsorted(map_ids, ref_frames[pending]), 0, len(map_ids) - 1)
+            found = map_ids[position] == ref_frames[pending]
+            if not found.all():
+                output_index = pending[np.argmin(found)]
+                raise ValueError(f"Plate {ref_frames[output_index]} is being used as a reference plate for Plate \
+                                  {self.rotation_metadata[output_index][2]} for target time {target_time} \
+                                    but does not yet exist. Please fix rotation file.")
+            ref_index = map_index[position]
+            combined = adder_batch(total_lat[pending], total_lon[pending], total_angle[pending],
+                                   self.rotation_data[ref_index, 1], self.rotation_data[ref_index, 2],
+                                   self.rotation_data[ref_index, 3])
+            total_lat[pending], total_lon[pending], total_angle[pending] = combined
+            ref_frames[pending] = self.rotation_metadata[ref_index, 1]
+        else:
+            if np.any(ref_frames != 0):
+                raise ValueError(f"Reference plates loop back on themselves for target time {target_time}. "
+                                 "Please fix rotation file.")
+
+        # Store final output
+        self.rotation_data[:num_rotations, 1] = total_lat
+        self.rotation_data[:num_rotations, 2] = total_lon
+        self.rotation_data[:num_rotations, 3] = total_angle
+        self.rotation_metadata[:num_rotations, 1] = 0
+        self.final_rotation_data[:num_rotations, 1:] = self.rotation_data[:num_rotations, 1:]
+        self.rot_list[:num_rotations] = self.rotation_metadata[:num_rotations, 2]
+        row_plates = self.rotation_metadata[:num_rotations, 2].tolist()
+        for index, plateid in enumerate(row_plates):
+            self.plate_id_to_index[plateid] = index
+
+        rounded = np.round(self.final_rotation_data[:num_rotations, 1:4], 2).tolist()
+        with open("rotfnd_output.txt", 'w') as outfile:
+            for plateid, index in self.plate_id_to_index.items():
+                plat, plon, pang = rounded[index]
+                outfile.write(f"plateid: {plateid} {row_plates[index]}, plat: {plat}, plon: {plon}, pang: {pang}, refplate: 0\n")
+
+    def process_chunks(self, chunk_generator):
+
+        for chunk in chunk_generator:
+            plateid = int(chunk.plateid)
+            if plateid in self.plate_id_to_index:
+                int_rot = self.plate_id_to_index[plateid]
+                rotlat = self.final_rotation_data[int_rot][1]
+                rotlo = self.final_rotation_data[int_rot][2]
+                rotan = self.final_rotation_data[int_rot][3]
+            else:
+                print(f"Plate id {plateid} not in rotation file. Assigning zero rotation")
+                instrumentation.add("plates missing from model", plateid)
+                instrumentation.count("chunks on missing plates")
+                rotlat = 0.0
+                rotlo = 0.0
+                rotan = 0.0
+
+            instrumentation.count("chunks")
+            instrumentation.count("vertices", len(chunk.records))
+            if chunk.records:
+                lats = np.array([ record.alat for record in chunk.records ], dtype=float)
+                longs = np.array([ record.along for record in chunk.records ], dtype=float)
+                post_lat, post_long = rotate_batch(lats, longs, rotlat, rotlo, rotan)
+                post_lat = np.round(post_lat, 4).tolist()
+                post_long = np.round(post_long, 4).tolist()
+                chunk.records = [ Record(lat, lon, record.pen)
+                                  for lat, lon, record in zip(post_lat, post_long, chunk.records) ]
+
+            yield chunk
@@ -0,0 +1,107 @@
+"""
+Keeps track of the frames a run has finished, so a run that was stopped or
+failed part way can be picked up again instead of starting over.
+
+Every run of more than one frame saves the manifest in the output folder after
+each frame. For each finished reconstruction time it lists the files the frame
+wrote and, for animations run with keep_frames, a PNG of the frame (one per
+figure) kept in output_folder/frames/. Only a run asked to resume reads it: it
+skips every frame whose files are still there and renders the rest. The mp4 is
+written again from the kept frames and the new ones, or, if the frames weren't
+kept, from every frame drawn again. Once a run has finished every frame and
+written the mp4, the kept frames are deleted and the mp4 becomes one of each
+frame's files instead.
+
+A job counts as the same if its inputs hash the same: the contents of the
+rotation and geographic files, the file colors, the map settings, the fixed
+plate and the outputs asked for. Anything else starts a fresh manifest.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 2
+
+def hash_inputs(job):
+    digest = hashlib.sha256()
+    settings = { "version": MANIFEST_VERSION,
+                 "projection": [ figure.proj for figure in job.figures ],
+                 "map": [ figure.kwargs for figure in job.figures ],
+                 "files": [ file[1:] for file in job.geo_files ],
+                 "fixed_plate": job.fixed_plate,
+                 "kml_tolerance": job.kml_tolerance,
+                 "single_pdf": job.single_pdf,
+                 "outputs": sorted(job.output_options),
+                 "file_names": job.file_names }
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    for file_name in [job.rotation_file] + [ file[2] for file in job.geo_files ]:
+        with open(file_name, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+class RunManifest:
+
+    def __init__(self, output_folder, inputs_hash, resume=False):
+        self.file_name = output_folder + "run_manifest.json"
+        self.frames_folder = output_folder + "frames/"
+        self.inputs_hash = inputs_hash
+        self.frames = {}    # k: reconstruction time as a string; v: {"time", "outputs", "frame_files"}
+
+        if resume and os.path.exists(self.file_name):
+            try:
+                with open(self.file_name, "r") as f:
+                    saved = json.load(f)
+                if saved.get("inputs_hash") == inputs_hash:
+                    self.frames = saved["frames"]
+                else:
+                    print("Inputs have changed since the last run, rendering every frame")
+            except (OSError, ValueError, KeyError) as err:
+                print(f"Could not read run manifest, rendering every frame: {err}")
+
+    def key(self, time):
+        return str(float(time))
+
+    def frame_file(self, time, suffix=""):
+        """Where the frame for time is kept for the animation, suffix telling apart the figures of a job."""
+        if not os.path.isdir(self.frames_folder): os.makedirs(self.frames_folder)
+        return self.frames_folder + f"frame_{float(time)}Ma{suffix}.png"
+
+    def done(self, time):
+        """The entry of a finished frame whose files all still exist, otherwise None."""
+        entry = self.frames.get(self.key(time))
+        if entry is None:
+            return None
+        files = entry["outputs"] + entry["frame_files"]
+        if not all(os.path.exists(file_name) for file_name in files):
+            return None
+        return entry
+
+    def record(self, time, outputs, frame_files=()):
+        self.frames[self.key(time)] = { "time": float(time), "outputs": outputs, "frame_files": list(frame_files) }
+        self.save()
+
+    def release_frames(self, videos):
+        """
+        Deletes the kept frames, once the videos made from them are written. The
+        videos are listed with every frame, so the frames are drawn again if one
+        goes missing.
+        """
+        for entry in self.frames.values():
+            for file_name in entry["frame_files"]:
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+            entry["frame_files"] = []
+            entry["outputs"] = entry["outputs"] + [ video for video in videos if video not in entry["outputs"] ]
+        self.save()
+        try:
+            os.rmdir(self.frames_folder)
+        except OSError:
+            pass    # missing, or holding other files
+
+    def save(self):
+        # written to the side and swapped in, so a run killed mid-write leaves the last manifest
+        temp_name = self.file_name + ".tmp"
+        with open(temp_name, "w") as f:
+            json.dump({ "version": MANIFEST_VERSION, "inputs_hash": self.inputs_hash, "frames": self.frames }, f, indent=2)
+        os.replace(temp_name, self.file_name)
@@ -0,0 +1,142 @@
+"""
+Line simplification for drawing and KML export.
+
+Douglas-Peucker is run on the sphere once per feature, all the way down, giving
+each point a significance: the tolerance (in radians) above which the point is
+dropped. Any level of detail is then just the points with significance above
+the tolerance, so one array per feature serves every map scale.
+
+Plate rotations move a feature without changing its shape, so significance is
+worked out on the unrotated points as they are read and cached by LevelOfDetail
+for later frames. The figure picks the tolerance from the map's scale (see
+Figure.simplify_tolerance), so no dropped point is more than half a pixel from
+the drawn line.
+
+Each feature's bounding cap is worked out and cached the same way, for culling
+features outside the map's view (see PlateTrackerJob.cull).
+"""
+import numpy as np
+
+from spherical_clip import to_xyz, bounding_caps
+import instrumentation
+
+def arc_distance(a, b):
+    """Angle between unit vectors, from the chord so it stays accurate for small angles."""
+    return 2 * np.arcsin(np.clip(np.linalg.norm(a - b, axis=1) / 2, 0.0, 1.0))
+
+def significance(lon, lat, start):
+    """
+    Douglas-Peucker significance of each point of one or more lines, where start
+    is True at each line's first point. Every segment still being split is
+    handled at once, so the loop runs once per level of the split tree.
+    """
+    n = len(lon)
+    xyz = to_xyz(lon, lat)
+    result = np.zeros(n)
+
+    first = np.flatnonzero(start)
+    last = np.append(first[1:] - 1, n - 1)
+    result[first] = np.inf
+    result[last] = np.inf
+
+    # segments still to split, as first and last point, and the significance of the split that made them
+    seg_a, seg_b, seg_cap = first, last, np.full(len(first), np.inf)
+    while True:
+        wide = seg_b - seg_a > 1
+        seg_a, seg_b, seg_cap = seg_a[wide], seg_b[wide], seg_cap[wide]
+        if len(seg_a) == 0:
+            return result
+
+        counts = seg_b - seg_a - 1
+        offsets = np.cumsum(counts) - counts
+        seg = np.repeat(np.arange(len(seg_a)), counts)
+        inner = seg_a[seg] + 1 + np.arange(len(seg)) - offsets[seg]
+
+        a, b, p = xyz[seg_a][seg], xyz[seg_b][seg], xyz[inner]
+        normal = np.cross(a, b)
+        length = np.linalg.norm(normal, axis=1)
+        to_end = np.minimum(arc_distance(p, a), arc_distance(p, b))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            normal = normal / length[:, None]
+            # the point is abreast of the segment if it lies between the planes through its ends
+            abreast = (np.einsum("ij,ij->i", np.cross(a, p), normal) >= 0) & \
+                      (np.einsum("ij,ij->i", np.cross(p, b), normal) >= 0)
+            cross_track = np.abs(np.arcsin(np.clip(np.einsum("ij,ij->i", p, normal), -1.0, 1.0)))
+        # segments with ends on top of each other (closed rings) measure from the ends
+        distance = np.where((length > 1e-12) & abreast, cross_track, to_end)
+
+        # split each segment at its farthest point
+        farthest = np.maximum.reduceat(distance, offsets)
+        hits = np.flatnonzero(distance == farthest[seg])
+        split = inner[hits[np.unique(seg[hits], return_index=True)[1]]]
+        value = np.minimum(farthest, seg_cap)   # never more significant than the split above it
+        result[split] = value
+
+        seg_a, seg_b, seg_cap = (np.concatenate((seg_a, split)), np.concatenate((split, seg_b)),
+                                 np.concatenate((value, value)))
+
+def feature_key(chunk):
+    """Identifies a feature from frame to frame, from its header and unrotated end points."""
+    records = chunk.records
+    return (chunk.layer, chunk.plateid, chunk.record_number, chunk.appears, chunk.disappears, len(records),
+            records[0].alat, records[0].along, records[-1].alat, records[-1].along)
+
+class LevelOfDetail:
+    """
+    Sets chunk.significance and chunk.bounding_cap on chunks passing through,
+    before they are rotated.
+    Features not seen before are gathered into batches of about batch_size
+    points and worked out together.
+    """
+
+    def __init__(self, batch_size=20000):
+        self.cache = {}     # k: feature_key; v: (significance of each record, bounding cap)
+        self.batch_size = batch_size
+
+    def annotate(self, chunk_generator):
+        waiting = []    # chunks held back, in file order, until the new features among them are worked out
+        new = []        # (key, chunk) of those new features
+        points = 0
+        for chunk in chunk_generator:
+            if len(chunk.records) > 2:
+                key = feature_key(chunk)
+                chunk.significance, chunk.bounding_cap = self.cache.get(key, (None, None))
+                if chunk.significance is None:
+                    new.append((key, chunk))
+                    points += len(chunk.records)
+            if not new:
+                yield chunk
+                continue
+            waiting.append(chunk)
+            if points >= self.batch_size:
+                self.work_out(new)
+                yield from waiting
+                waiting, new, points = [], [], 0
+
+        if new:
+            self.work_out(new)
+            yield from waiting
+
+    def work_out(self, chunks):
+        lengths = [ len(chunk.records) for key, chunk in chunks ]
+        total = sum(lengths)
+        lon = np.fromiter((record.along for key, chunk in chunks for record in chunk.records), dtype=float, count=total)
+        lat = np.fromiter((record.alat for key, chunk in chunks for record in chunk.records), dtype=float, count=total)
+        start = np.fromiter((record.pen != 2 for key, chunk in chunks for record in chunk.records), dtype=bool, count=total)
+        start[np.cumsum(lengths) - lengths] = True
+
+        values = significance(lon, lat, start)
+        caps = zip(*bounding_caps(lon, lat, lengths))
+        instrumentation.count("features simplified", len(chunks))
+        for (key, chunk), part, cap in zip(chunks, np.split(values, np.cumsum(lengths)[:-1]), caps):
+            self.cache[key] = (part, cap)
+            chunk.significance, chunk.bounding_cap = part, cap
+
+def keep_mask(chunk, tolerance):
+    """The records of chunk to draw at tolerance, or None to draw them all."""
+    if not tolerance or chunk.significance is None:
+        return None
+    keep = chunk.significance > tolerance
+    if keep.sum() < 4:
+        return None     # too small to simplify and still fill
+    return keep
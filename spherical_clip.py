@@ -0,0 +1,229 @@
+"""
+Clips polygon rings on the sphere, for filling polygons on maps that only show
+part of the globe (Orthographic, Azimuthal Equidistant, polar Stereographic).
+
+The visible part of those maps is a spherical cap: every point within radius
+degrees of the map center. Rings are rotated so the center is the north pole,
+cut where they cross the cap's edge and joined along that edge, so the pieces
+can be projected as they are, with no splitting in lon/lat.
+"""
+from bisect import bisect_left
+import numpy as np
+
+def to_xyz(lon, lat):
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+def to_lonlat(xyz):
+    lon = np.degrees(np.arctan2(xyz[:, 1], xyz[:, 0]))
+    lat = np.degrees(np.arcsin(np.clip(xyz[:, 2], -1.0, 1.0)))
+    return lon, lat
+
+def rotation_to_pole(center_lon, center_lat):
+    """Rotation matrix that takes (center_lon, center_lat) to the north pole."""
+    lon = np.radians(center_lon)
+    tilt = np.radians(90.0 - center_lat)
+    spin = np.array([ [np.cos(lon), np.sin(lon), 0.0],
+                      [-np.sin(lon), np.cos(lon), 0.0],
+                      [0.0, 0.0, 1.0] ])
+    lift = np.array([ [np.cos(tilt), 0.0, -np.sin(tilt)],
+                      [0.0, 1.0, 0.0],
+                      [np.sin(tilt), 0.0, np.cos(tilt)] ])
+    return lift @ spin
+
+def densify(lon, lat, step=1.0, wrap=True):
+    """
+    Adds points so no edge of the ring spans more than step degrees, interpolating
+    in lon/lat the way cartopy does for PlateCarree geometry. With wrap, edges
+    longer than 180 degrees of longitude go the short way across the antimeridian.
+    """
+    dlon = np.diff(lon)
+    if wrap:
+        dlon = (dlon + 180) % 360 - 180
+    dlat = np.diff(lat)
+    pieces = np.maximum(np.ceil(np.maximum(np.abs(dlon), np.abs(dlat)) / step), 1).astype(int)
+    if (pieces == 1).all():
+        return lon, lat
+    return subdivide(lon, lat, dlon, dlat, pieces)
+
+def densify_lines(lon, lat, start, step=1.0):
+    """
+    densify for lines, where start is True at points the pen moves to without
+    drawing. Those moves are left alone, and the start mask of the new points is
+    returned with them.
+    """
+    dlon = (np.diff(lon) + 180) % 360 - 180
+    dlat = np.diff(lat)
+    pieces = np.maximum(np.ceil(np.maximum(np.abs(dlon), np.abs(dlat)) / step), 1).astype(int)
+    pieces[start[1:]] = 1
+    if (pieces == 1).all():
+        return lon, lat, start
+
+    new_lon, new_lat = subdivide(lon, lat, dlon, dlat, pieces)
+    new_start = np.zeros(len(new_lon), dtype=bool)
+    new_start[np.cumsum(pieces) - pieces] = start[:-1]
+    new_start[-1] = start[-1]
+    return new_lon, new_lat, new_start
+
+def subdivide(lon, lat, dlon, dlat, pieces):
+    """Splits edge i of the line into pieces[i] equal steps of (dlon[i], dlat[i]) / pieces[i]."""
+    edge = np.repeat(np.arange(len(dlon)), pieces)
+    fraction = np.arange(len(edge)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    fraction = fraction / pieces[edge]
+    new_lon = np.append(lon[edge] + fraction * dlon[edge], lon[-1])
+    new_lat = np.append(lat[edge] + fraction * dlat[edge], lat[-1])
+    return new_lon, new_lat
+
+def bounding_caps(lon, lat, lengths):
+    """
+    The smallest caps, roughly, around runs of lengths points: centered on each
+    run's mean direction, reaching its farthest point. Returns the centers as
+    unit vectors and the radii in degrees.
+    """
+    xyz = to_xyz(lon, lat)
+    offsets = np.cumsum(lengths) - lengths
+    center = np.add.reduceat(xyz, offsets)
+    size = np.linalg.norm(center, axis=1)
+    center = center / np.where(size > 1e-9, size, 1.0)[:, None]
+    height = np.einsum("ij,ij->i", xyz, np.repeat(center, lengths, axis=0))
+    radius = np.degrees(np.arccos(np.clip(np.minimum.reduceat(height, offsets), -1.0, 1.0)))
+    radius[size <= 1e-9] = 180.0    # points all round the globe
+    return center, radius
+
+class Cap:
+    """The part of the globe within radius degrees of (center_lon, center_lat)."""
+
+    def __init__(self, center_lon, center_lat, radius, step=1.0):
+        self.rotation = rotation_to_pole(center_lon, center_lat)
+        self.radius = radius
+        self.edge_lat = 90.0 - radius   # latitude of the cap's edge once its center is the pole
+        self.step = step                # spacing of the points added along the edge
+
+    def edge_points(self, start_lon, end_lon):
+        """Points along the cap's edge going east from start_lon to end_lon (rotated longitudes), ends excluded."""
+        span = (end_lon - start_lon) % 360
+        edge_lon = start_lon + np.arange(self.step, span, self.step)
+        return np.column_stack((edge_lon, np.full(len(edge_lon), self.edge_lat)))
+
+    def contains(self, lon, lat):
+        """Whether each point is inside the cap."""
+        height = to_xyz(lon, lat) @ self.rotation[2]
+        return height >= np.sin(np.radians(self.edge_lat))
+
+    def edge_crossings(self, lon, lat, index):
+        """
+        Where the edges from point index - 1 to point index cross the cap's edge,
+        as lon/lat arrays, found the way clip finds them.
+        """
+        xyz = to_xyz(np.concatenate((lon[index - 1], lon[index])), np.concatenate((lat[index - 1], lat[index]))) @ self.rotation.T
+        before, after = xyz[:len(index)], xyz[len(index):]
+        height_before = before[:, 2] - np.sin(np.radians(self.edge_lat))
+        height_after = after[:, 2] - np.sin(np.radians(self.edge_lat))
+        t = height_before / (height_before - height_after)
+        chord = before + t[:, None] * (after - before)
+        cross_lon = np.degrees(np.arctan2(chord[:, 1], chord[:, 0]))
+        edge = self.unrotate(np.column_stack((cross_lon, np.full(len(index), self.edge_lat))))
+        return edge[:, 0], edge[:, 1]
+
+    def overlaps(self, center, radius):
+        """Whether a cap of radius degrees round the unit vector center reaches into this cap."""
+        height = min(max(float(center @ self.rotation[2]), -1.0), 1.0)
+        return np.degrees(np.arccos(height)) <= self.radius + radius
+
+    def edge_circle(self):
+        """The whole edge of the cap as a closed counterclockwise lon/lat ring."""
+        circle_lon = np.append(np.arange(-180.0, 180.0, self.step), -180.0)
+        circle = np.column_stack((circle_lon, np.full(len(circle_lon), self.edge_lat)))
+        return self.unrotate(circle)
+
+    def clip(self, lon, lat):
+        """
+        Returns the parts of a closed, counterclockwise ring inside the cap as a
+        list of (n, 2) arrays of closed lon/lat rings. Edges are treated as great
+        circle arcs, so long edges should be densified first.
+        """
+        xyz = to_xyz(lon, lat) @ self.rotation.T
+        rot_lon, rot_lat = to_lonlat(xyz)
+        inside = rot_lat >= self.edge_lat
+
+        if inside.all() or not inside.any():
+            winding = np.sum((np.diff(rot_lon) + 180) % 360 - 180)
+            if inside.all():
+                if winding > -180:
+                    return [np.column_stack((lon, lat))]
+                # the ring goes round the part of the globe left out of the cap, which becomes a hole
+                return [self.edge_circle(), np.column_stack((lon, lat))]
+            # outside the cap, unless the ring goes all the way round it
+            if winding < 180:
+                return []
+            return [self.edge_circle()]
+
+        # crossing[i]: the ring crosses the edge between points i - 1 and i
+        n = len(lon)
+        crossing = np.zeros(n, dtype=bool)
+        crossing[1:] = inside[1:] != inside[:-1]
+        index = np.flatnonzero(crossing)
+
+        # where the chord between the two points crosses the edge's plane, pushed onto the edge
+        height = xyz[:, 2] - np.sin(np.radians(self.edge_lat))
+        t = height[index - 1] / (height[index - 1] - height[index])
+        chord = xyz[index - 1] + t[:, None] * (xyz[index] - xyz[index - 1])
+        cross_lon = np.degrees(np.arctan2(chord[:, 1], chord[:, 0]))
+
+        # slot 2i is the crossing before point i, slot 2i + 1 is point i
+        slots = np.empty((2 * n, 2))
+        slots[1::2, 0] = rot_lon
+        slots[1::2, 1] = rot_lat
+        slots[2 * index, 0] = cross_lon
+        slots[2 * index, 1] = self.edge_lat
+        keep = np.zeros(2 * n, dtype=bool)
+        keep[2 * index] = True
+        keep[1:-1:2] = inside[:-1]      # the last point repeats the first
+        entry = np.zeros(2 * n, dtype=bool)
+        entry[2 * index] = inside[index]
+
+        points = slots[keep]
+        cuts = np.flatnonzero(entry[keep]).tolist()
+        bounds = zip([0] + cuts, cuts + [len(points)])
+        sections = [ points[start:end] for start, end in bounds if end > start ]
+        if len(sections) > 1 and (len(cuts) == 0 or cuts[0] != 0):
+            # the ring started inside the cap, so its first section continues the last
+            sections[-1] = np.vstack((sections[-1], sections.pop(0)))
+
+        return [ self.unrotate(ring) for ring in self.join_sections(sections) ]
+
+    def join_sections(self, sections):
+        """
+        From where each section leaves the cap, goes east along the edge to the
+        next place the ring comes back in, like split_polygons does for the
+        hemisphere strips.
+        """
+        entries = sorted((section[0][0], i) for i, section in enumerate(sections))
+        entry_lons = [ entry_lon for entry_lon, i in entries ]
+
+        rings = []
+        joined = [False] * len(sections)
+        for first in range(len(sections)):
+            if joined[first]: continue
+            parts = []
+            i = first
+            while True:
+                joined[i] = True
+                parts.append(sections[i])
+                exit_lon = sections[i][-1][0]
+                k = bisect_left(entry_lons, exit_lon) % len(entries)
+                entry_lon, i = entries[k]
+                if joined[i] and i != first:
+                    break   # the ring crosses itself, close straight back to the first section
+                parts.append(self.edge_points(exit_lon, entry_lon))
+                if i == first:
+                    break
+
+            parts.append(sections[first][:1])
+            rings.append(np.vstack(parts))
+        return rings
+
+    def unrotate(self, ring):
+        lon, lat = to_lonlat(to_xyz(ring[:, 0], ring[:, 1]) @ self.rotation)
+        return np.column_stack((lon, lat))
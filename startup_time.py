@@ -0,0 +1,82 @@
+"""
+Measures PaleoMapper startup against a time budget. Each measurement runs in a
+fresh interpreter so nothing is already imported.
+
+python startup_time.py              # report, exit 1 if over budget
+python startup_time.py --runs 5 --window-budget 1.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# seconds, median over runs
+WINDOW_BUDGET = 1.0
+CLI_BUDGET = 0.6
+
+# none of these should be loaded before the first run is started
+HEAVY_MODULES = ["pygplates", "cartopy", "shapely", "matplotlib.pyplot", "simplekml"]
+
+WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+import sys, json
+from PySide6.QtWidgets import QApplication
+app = QApplication(sys.argv)
+from gui import PlateTrackerApp
+window = PlateTrackerApp()
+window.show()
+app.processEvents()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+CLI_SCRIPT = """
+import time
+start = time.perf_counter()
+import sys, json
+import cli
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r + ["PySide6"] if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def time_script(script, runs):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                             env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    times = sorted(result["seconds"] for result in results)
+    return {"median": times[len(times) // 2], "min": times[0], "max": times[-1],
+            "loaded": results[-1]["loaded"]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Check PaleoMapper startup time against a budget.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--window-budget", type=float, default=WINDOW_BUDGET)
+    parser.add_argument("--cli-budget", type=float, default=CLI_BUDGET)
+    args = parser.parse_args()
+
+    over_budget = False
+    for name, script, budget in [("launch to window", WINDOW_SCRIPT, args.window_budget),
+                                 ("cli import", CLI_SCRIPT, args.cli_budget)]:
+        result = time_script(script, args.runs)
+        status = "ok"
+        if result["median"] > budget:
+            status = "OVER BUDGET"
+            over_budget = True
+        if result["loaded"]:
+            status += f", loaded {', '.join(result['loaded'])}"
+            over_budget = True
+        print(f"{name}: {result['median']:.3f}s (min {result['min']:.3f}s, max {result['max']:.3f}s, "
+              f"budget {budget:.2f}s) {status}")
+
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
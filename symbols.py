@@ -1,10 +1,7 @@
 import csv
 import math
-import shapely.geometry as shapegeo
 import numpy as np
 from matplotlib.path import Path
-from cartopy.mpl.patch import geos_to_path
-from matplotlib.text import TextPath
 from matplotlib.transforms import Affine2D
 from numpy import deg2rad
 
@@ -66,6 +63,8 @@ def load_shape_library(file_path):
             library[shape_name]['pen'].append(pen)
 
 def create_circle(lat, lon, diameter):
+    import shapely.geometry as shapegeo
+    from cartopy.mpl.patch import geos_to_path
 
     radius = diameter / 2
 
@@ -100,6 +99,7 @@ def create_symbol(lat, lon, size, azimuth, symbol):
     return symbol_path
 
 def create_text(lat, lon, size, azimuth, text):
+    from matplotlib.text import TextPath
 
     # find boundaries of text box
     text_size = size * 1.3
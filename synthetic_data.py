@@ -0,0 +1,117 @@
+"""
+Synthetic inputs for benchmarking: rotation models (.rot) with a configurable
+plate tree, and DAT/CSV geometry with configurable feature and vertex counts.
+Everything is seeded so the same arguments always write the same files.
+"""
+import math
+import random
+
+# fill colors cycled through DAT features, so plot_to_screen has to start new batches
+DAT_COLORS = [ ("brown", "khaki"), ("black", "none"), ("navy", "lightblue"), ("darkgreen", "none") ]
+CSV_SYMBOLS = [ "circle", "dot", "triangle", "square", "star", "diamond", "label" ]
+
+def plate_ids(num_plates):
+    """Plate ids for a synthetic model. 999 is skipped, rotfnd treats it as a comment plate."""
+    ids = []
+    plateid = 101
+    while len(ids) < num_plates:
+        if plateid != 999:
+            ids.append(plateid)
+        plateid += 1
+    return ids
+
+def plate_tree(num_plates, tree_depth, seed=0):
+    """
+    Returns {plateid: refplate}. Plates are spread evenly over tree_depth levels,
+    level 1 is rotated relative to the absolute frame (0) and every deeper plate
+    to a random plate on the level above.
+    """
+    rng = random.Random(seed)
+    ids = plate_ids(num_plates)
+    tree_depth = max(1, min(tree_depth, num_plates))
+    levels = [ ids[level::tree_depth] for level in range(tree_depth) ]
+
+    refs = {}
+    for level, plates in enumerate(levels):
+        for plateid in plates:
+            refs[plateid] = 0 if level == 0 else rng.choice(levels[level - 1])
+    return refs
+
+def write_rotation_model(filename, num_plates=100, tree_depth=4, time_samples=20, max_time=600.0, seed=0):
+    """
+    Writes a .rot file with time_samples stage poles per plate, evenly spaced from
+    0 to max_time. Each plate rotates about a fixed random pole at a random rate,
+    so every plate has a valid rotation for any time below max_time.
+    """
+    rng = random.Random(seed)
+    refs = plate_tree(num_plates, tree_depth, seed)
+    time_samples = max(2, time_samples)
+    times = [ max_time * i / (time_samples - 1) for i in range(time_samples) ]
+
+    with open(filename, "w") as f:
+        for plateid, refplate in refs.items():
+            pole_lat = rng.uniform(-89.0, 89.0)
+            pole_lon = rng.uniform(-179.0, 179.0)
+            rate = rng.uniform(0.05, 0.25)     # degrees per Myr
+            for time in times:
+                angle = (rate * time + 180.0) % 360.0 - 180.0
+                f.write('%03d %6.1f %8.4f %9.4f %9.4f  %03d !! synthetic\n'
+                        % (plateid, time, pole_lat, pole_lon, angle, refplate))
+    return list(refs)
+
+def polygon_points(rng, num_vertices, center_lat, center_lon, radius):
+    """Closed, slightly irregular ring of num_vertices points (last point repeats the first)."""
+    points = []
+    for i in range(num_vertices - 1):
+        bearing = 2 * math.pi * i / (num_vertices - 1)
+        r = radius * rng.uniform(0.7, 1.0)
+        lat = max(-89.9, min(89.9, center_lat + r * math.sin(bearing)))
+        lon = center_lon + r * math.cos(bearing) / max(0.2, math.cos(math.radians(center_lat)))
+        lon = (lon + 180.0) % 360.0 - 180.0
+        points.append((lat, lon))
+    points.append(points[0])
+    return points
+
+def write_dat_geometry(filename, num_features=500, vertices_per_feature=50, plates=None,
+                       max_time=600.0, seed=0):
+    """
+    Writes a DAT file of polygon features on random plates. About half the
+    features are always present (999/-999), the rest get a random valid age
+    range, so sanitize_dat has records to drop at older plot times.
+    """
+    rng = random.Random(seed)
+    plates = plates or plate_ids(10)
+    vertices_per_feature = max(4, vertices_per_feature)
+
+    with open(filename, "w") as f:
+        for feature in range(num_features):
+            plateid = rng.choice(plates)
+            if rng.random() < 0.5:
+                appears, disappears = 999.0, -999.0
+            else:
+                appears = rng.uniform(0.0, max_time)
+                disappears = rng.uniform(-999.0, appears) if rng.random() < 0.2 else 0.0
+            bcolor, fcolor = DAT_COLORS[(feature // 10) % len(DAT_COLORS)]
+            f.write(f"9999 9999,DAT,feature{feature},none,{bcolor},{fcolor},1,0\n")
+            f.write('%4d%7.1f%7.1f%3s%4d%4d%4d%6d\n' % (plateid, appears, disappears, "CS", 0, plateid, 0, feature))
+
+            points = polygon_points(rng, vertices_per_feature, rng.uniform(-80.0, 80.0),
+                                    rng.uniform(-180.0, 180.0), rng.uniform(1.0, 10.0))
+            pen = 3
+            for lat, lon in points:
+                f.write('%9.4f%10.4f%2d\n' % (lat, lon, pen))
+                pen = 2
+            f.write("  99.0000   99.0000 3\n")
+
+def write_csv_symbols(filename, num_features=200, plates=None, seed=0):
+    """Writes a symbol CSV in the layout read_csv_in_chunks expects."""
+    rng = random.Random(seed)
+    plates = plates or plate_ids(10)
+
+    with open(filename, "w") as f:
+        f.write("urn,label,plateid,lat,lon,symbol,size,azimuth,appears,disappears,bcolor,fcolor\n")
+        for urn in range(1, num_features + 1):
+            symbol = CSV_SYMBOLS[urn % len(CSV_SYMBOLS)]
+            f.write(f"{urn},site{urn},{rng.choice(plates)},{rng.uniform(-80.0, 80.0):.4f},"
+                    f"{rng.uniform(-180.0, 180.0):.4f},{symbol},{rng.uniform(0.5, 3.0):.2f},"
+                    f"{rng.uniform(0.0, 360.0):.1f},999,-999,red,none\n")
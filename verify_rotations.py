@@ -0,0 +1,319 @@
+"""
+Checks the batched rotation engine (rotation_engine_vector.py) against the scalar
+engines in rotation_engine_class.py and rotation_engine_array.py, and times both.
+
+For every model and reconstruction time it solves the plate rotations with each
+engine and reports, per plate, the largest angle between the scalar and batched
+rotations. It then rotates a grid of points about every plate's pole with the
+scalar rotate and rotate_batch and reports the largest point error.
+
+python verify_rotations.py
+python verify_rotations.py --models default_input/Scotese_Plate_Model.rot --times 0 300 25
+
+A model is UNVERIFIED, and the run fails, if the reference scalar engine solved
+it at none of the times or raised at most of them: the batched engine was then
+hardly compared against anything.
+
+The engines are not equivalent everywhere. adder_batch clips the arccos
+arguments the scalar adder raises a math domain error on (rounding pushes them
+just past +-1), so the batched engine returns a rotation where the scalar
+engines raise. Those cases are counted as "raised in the scalar adder" and as
+scalar engine failures below, and are never compared.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+import rotation_engine_array
+import rotation_engine_class
+import rotation_engine_vector
+
+MODELS = [ "default_input/Scotese_Plate_Model.rot",
+           "external_input/Muller_1000_0_rotfile.rot",
+           "m17v2d3_81_v18e_cleanupv1.rot" ]
+
+ENGINES = { "class": rotation_engine_class.RotationEngine,
+            "array": rotation_engine_array.RotationEngine,
+            "vector": rotation_engine_vector.VectorRotationEngine }
+
+def quaternions(rotations):
+    """Unit quaternions for an (N, 3) array of pole lat, pole lon, angle in degrees."""
+    lat, lon, angle = np.radians(rotations).T
+    half = angle / 2.0
+    return np.stack([ np.cos(half),
+                      np.sin(half) * np.cos(lat) * np.cos(lon),
+                      np.sin(half) * np.cos(lat) * np.sin(lon),
+                      np.sin(half) * np.sin(lat) ], axis=1)
+
+def rotation_error(rotations1, rotations2):
+    """
+    Angle in degrees of the rotation taking each rotation in 1 to the one in 2. Uses
+    atan2 on the relative quaternion, arccos of a dot product near 1 bottoms out
+    around 1e-6 degrees.
+    """
+    w1, x1, y1, z1 = quaternions(rotations1).T
+    w2, x2, y2, z2 = quaternions(rotations2).T
+    # conjugate(q1) * q2
+    w = w1*w2 + x1*x2 + y1*y2 + z1*z2
+    x = w1*x2 - x1*w2 - y1*z2 + z1*y2
+    y = w1*y2 + x1*z2 - y1*w2 - z1*x2
+    z = w1*z2 - x1*y2 + y1*x2 - z1*w2
+    error = np.degrees(2.0 * np.arctan2(np.sqrt(x*x + y*y + z*z), np.abs(w)))
+    # nan rotations (repeated times in the model) only match each other
+    nan1 = np.isnan(rotations1).any(axis=1)
+    nan2 = np.isnan(rotations2).any(axis=1)
+    return np.where(nan1 & nan2, 0.0, np.where(nan1 | nan2, 180.0, error))
+
+def point_distance(lat1, lon1, lat2, lon2):
+    """Great circle distance in degrees."""
+    lat1, lon1, lat2, lon2 = np.radians([lat1, lon1, lat2, lon2])
+    a = np.sin((lat2 - lat1) / 2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0)**2
+    return np.degrees(2.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))))
+
+def point_grid(num_points):
+    """Roughly even points over the sphere, plus the poles the rotate functions special-case."""
+    i = np.arange(num_points) + 0.5
+    lat = np.degrees(np.arcsin(1.0 - 2.0 * i / num_points))
+    lon = (np.degrees(np.pi * (1.0 + 5.0**0.5) * i) + 180.0) % 360.0 - 180.0
+    return np.append(lat, [90.0, -90.0]), np.append(lon, [0.0, 0.0])
+
+def solve(engine_class, model, plot_time):
+    """Returns ({plateid: (lat, lon, angle)}, seconds), or (error message, seconds)."""
+    engine = engine_class()
+    start = time.perf_counter()
+    try:
+        engine.rotfnd(model, plot_time)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}", time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    if isinstance(engine.plate_id_to_index, dict):
+        index_map = engine.plate_id_to_index.items()
+    else:
+        index_map = [ (plateid, index) for plateid, index in enumerate(engine.plate_id_to_index) if index != -1 ]
+    rotations = { int(plateid): tuple(engine.final_rotation_data[index][1:4]) for plateid, index in index_map }
+    if not rotations:
+        # the array engine prints some errors and returns without solving
+        return "no rotations solved", elapsed
+    return rotations, elapsed
+
+def compare_points(rotations, lat, lon):
+    """Rotates the point grid about every plate's pole with both rotate paths."""
+    scalar = rotation_engine_class.RotationEngine()
+    scalar_time = 0.0
+    vector_time = 0.0
+    max_error = 0.0
+    for rotlat, rotlo, rotan in rotations.values():
+        start = time.perf_counter()
+        scalar_points = [ scalar.rotate(alat, along, rotlat, rotlo, rotan) for alat, along in zip(lat, lon) ]
+        scalar_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector_lat, vector_lon = rotation_engine_vector.rotate_batch(lat, lon, rotlat, rotlo, rotan)
+        vector_time += time.perf_counter() - start
+
+        scalar_lat, scalar_lon = np.array(scalar_points).T
+        max_error = max(max_error, float(np.max(point_distance(scalar_lat, scalar_lon, vector_lat, vector_lon))))
+    return max_error, scalar_time, vector_time
+
+def compare_adder(model):
+    """
+    Combines every pair of consecutive stage poles in the model (and each pole with
+    the reverse of the next) with the scalar adder and adder_batch. Returns the
+    largest rotation error, the number of pairs compared and the number the scalar
+    adder raised on, plus the time of both paths.
+    """
+    rows, _, _ = rotation_engine_vector.read_rotation_model(model)
+    poles1 = np.concatenate([rows[:-1, 1:4], rows[:-1, 1:4]])
+    poles2 = np.concatenate([rows[1:, 1:4], rows[1:, 1:4] * [1.0, 1.0, -1.0]])
+
+    scalar = rotation_engine_class.RotationEngine()
+    start = time.perf_counter()
+    scalar_results = []
+    for pole1, pole2 in zip(poles1.tolist(), poles2.tolist()):
+        try:
+            scalar_results.append(scalar.adder(*pole1, *pole2))
+        except (ValueError, ZeroDivisionError):
+            scalar_results.append(None)
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector_results = np.stack(rotation_engine_vector.adder_batch(*poles1.T, *poles2.T), axis=1)
+    vector_time = time.perf_counter() - start
+
+    solved = np.array([ result is not None for result in scalar_results ])
+    scalar_results = np.array([ result for result in scalar_results if result is not None ]).reshape(-1, 3)
+    errors = rotation_error(scalar_results, vector_results[solved])
+    return (float(errors.max(initial=0.0)), int(solved.sum()), int((~solved).sum()),
+            scalar_time, vector_time)
+
+def verify_model(model, times, num_points, reference):
+    """
+    Solves the model at every time with each engine. Outcomes per time and scalar
+    engine: both solve (rotations compared plate by plate), both fail (fine), only
+    the scalar engine fails (reported; the batched engine clips the acos domain
+    errors the scalar one raises), or only the batched engine fails (a mismatch).
+    """
+    lat, lon = point_grid(num_points)
+    plate_errors = {}       # k: plateid; v: (max error, time, scalar engine)
+    mismatches = []
+    scalar_failures = {}    # k: scalar engine; v: {error: [times]}
+    vector_only = {}        # k: scalar engine; v: times only the batched engine solved
+    compared_times = 0
+    rotfnd_times = { name: 0.0 for name in ENGINES }
+    point_error = 0.0
+    rotate_times = [0.0, 0.0]
+
+    for plot_time in times:
+        results = {}
+        for name, engine_class in ENGINES.items():
+            results[name], elapsed = solve(engine_class, model, plot_time)
+            rotfnd_times[name] += elapsed
+
+        vector = results["vector"]
+        vector_failed = isinstance(vector, str)
+        for name in ENGINES:
+            if name == "vector":
+                continue
+            scalar = results[name]
+            scalar_failed = isinstance(scalar, str)
+            if scalar_failed:
+                scalar_failures.setdefault(name, {}).setdefault(scalar.split(":")[0], []).append(float(plot_time))
+                if not vector_failed:
+                    vector_only[name] = vector_only.get(name, 0) + 1
+                continue
+            if vector_failed:
+                if name == reference:
+                    mismatches.append({ "time": float(plot_time), "engine": name, "vector": vector })
+                continue
+
+            if set(scalar) != set(vector):
+                mismatches.append({ "time": float(plot_time), "engine": name,
+                                    "plates": sorted(set(scalar) ^ set(vector)) })
+            plates = sorted(set(scalar) & set(vector))
+            if not plates:
+                continue
+            compared_times += name == reference
+            errors = rotation_error(np.array([ scalar[p] for p in plates ]), np.array([ vector[p] for p in plates ]))
+            for plateid, error in zip(plates, errors):
+                if plateid not in plate_errors or error > plate_errors[plateid][0]:
+                    plate_errors[plateid] = (float(error), float(plot_time), name)
+
+        if not vector_failed:
+            finite = { plateid: rotation for plateid, rotation in vector.items() if np.isfinite(rotation).all() }
+            error, scalar_time, vector_time = compare_points(finite, lat, lon)
+            point_error = max(point_error, error)
+            rotate_times[0] += scalar_time
+            rotate_times[1] += vector_time
+
+    adder_error, adder_pairs, adder_raised, adder_scalar, adder_vector = compare_adder(model)
+
+    return { "plate_errors": plate_errors,
+             "max_rotation_error": max([ error for error, _, _ in plate_errors.values() ], default=0.0),
+             "max_point_error": point_error,
+             "max_adder_error": adder_error,
+             "adder_pairs": adder_pairs,
+             "adder_scalar_raised": adder_raised,
+             "compared_times": compared_times,
+             "mismatches": mismatches,
+             "scalar_failures": scalar_failures,
+             "vector_only": vector_only,
+             "rotfnd_seconds": rotfnd_times,
+             "rotate_seconds": { "scalar": rotate_times[0], "vector": rotate_times[1] },
+             "adder_seconds": { "scalar": adder_scalar, "vector": adder_vector } }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Check the batched rotation engine against the scalar engines.")
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--times", nargs=3, type=float, default=[0.0, 600.0, 50.0], metavar=("START", "END", "STEP"))
+    parser.add_argument("--points", type=int, default=500, help="points rotated about each plate pole")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="largest accepted error in degrees")
+    parser.add_argument("--reference", default="class", choices=["class", "array"],
+                        help="scalar engine the batched engine must solve whenever it does")
+    parser.add_argument("--verbose", action="store_true", help="list the error for every plate")
+    parser.add_argument("--output", help="write the full report as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    start, end, step = args.times
+    times = list(np.arange(start, end + step / 2.0, step))     # numpy times, as get_time_array gives
+
+    report = {}
+    failed = False
+    unverified = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        models = [ os.path.abspath(model) for model in args.models ]
+        os.chdir(work_dir)     # rotfnd writes rotfnd_output.txt to the working directory
+        try:
+            for model in models:
+                name = os.path.relpath(model, REPO_DIR)
+                if not os.path.exists(model):
+                    print(f"{name}: not found, skipped")
+                    continue
+                print(f"{name}: {len(times)} times from {start} to {end}")
+                result = verify_model(model, times, args.points, args.reference)
+                report[name] = result
+
+                for plateid, (error, plot_time, engine) in sorted(result["plate_errors"].items()):
+                    if args.verbose or error > args.tolerance:
+                        print(f"  plate {plateid:5d}: {error:.3e} deg at {plot_time}Ma ({engine})")
+                for mismatch in result["mismatches"]:
+                    print(f"  MISMATCH {mismatch}")
+                for engine, failures in result["scalar_failures"].items():
+                    for error, failed_times in failures.items():
+                        print(f"  {engine} engine raised {error} at {len(failed_times)} of {len(times)} times")
+                for engine, count in result["vector_only"].items():
+                    print(f"  batched engine solved {count} times the {engine} engine raised at, not compared")
+
+                rotfnd = result["rotfnd_seconds"]
+                rotate = result["rotate_seconds"]
+                adder = result["adder_seconds"]
+                print(f"  rotations compared at {result['compared_times']} times: max error "
+                      f"{result['max_rotation_error']:.3e} deg over {len(result['plate_errors'])} plates")
+                print(f"  max point error {result['max_point_error']:.3e} deg, max adder error "
+                      f"{result['max_adder_error']:.3e} deg over {result['adder_pairs']} pole pairs "
+                      f"({result['adder_scalar_raised']} raised in the scalar adder)")
+                print("  rotfnd " + ", ".join(f"{engine} {seconds:.3f}s" for engine, seconds in rotfnd.items()) +
+                      f"; rotate scalar {rotate['scalar']:.3f}s, vector {rotate['vector']:.3f}s"
+                      f"; adder scalar {adder['scalar']:.3f}s, vector {adder['vector']:.3f}s")
+
+                reference_raised = sum(len(failed_times) for failed_times in result["scalar_failures"].get(args.reference, {}).values())
+                if result["compared_times"] == 0 or reference_raised > len(times) / 2:
+                    print(f"  UNVERIFIED: the {args.reference} engine raised at {reference_raised} of {len(times)} times, "
+                          f"rotations compared at {result['compared_times']}")
+                    unverified.append(name)
+                result["verified"] = name not in unverified
+
+                if (result["mismatches"] or result["max_rotation_error"] > args.tolerance
+                        or result["max_point_error"] > args.tolerance
+                        or result["max_adder_error"] > args.tolerance):
+                    failed = True
+        finally:
+            os.chdir(cwd)
+
+    if args.output:
+        for result in report.values():
+            result["plate_errors"] = { str(plateid): error for plateid, error in result["plate_errors"].items() }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if failed:
+        print("FAILED")
+    elif unverified:
+        print("UNVERIFIED: " + ", ".join(unverified))
+    else:
+        print("OK")
+    return 1 if failed or unverified else 0
+
+if __name__ == "__main__":
+    sys.exit(main())